@@ -0,0 +1,7 @@
+"""Performance tools and benchmarks built on the tutorial's examples.
+
+Each module can be run directly from the root of the checkout, e.g.::
+
+    python -m perf.pool_strategies --help
+
+"""
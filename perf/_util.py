@@ -0,0 +1,139 @@
+import contextlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import event
+
+
+class Measurement(object):
+    """Result of :func:`measure`."""
+
+    def __init__(self):
+        self.elapsed = 0.0
+        self.peak_memory = None
+        self.statements = None
+
+    def __repr__(self):
+        return "Measurement(elapsed=%r, peak_memory=%r, statements=%r)" % (
+            self.elapsed,
+            self.peak_memory,
+            self.statements,
+        )
+
+
+@contextlib.contextmanager
+def measure(engine=None, memory=False):
+    """Time a block; optionally count statements and trace peak memory.
+
+    Statements are counted for ``engine`` if given.  Tracing memory
+    slows the block down considerably, so elapsed time measured with
+    ``memory=True`` shouldn't be compared to time measured without it.
+
+    """
+    result = Measurement()
+
+    if engine is not None:
+        result.statements = 0
+
+        def count(*arg):
+            result.statements += 1
+
+        event.listen(engine, "before_cursor_execute", count)
+
+    if memory:
+        tracemalloc.start()
+
+    now = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result.elapsed = time.perf_counter() - now
+        if memory:
+            result.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if engine is not None:
+            event.remove(engine, "before_cursor_execute", count)
+
+
+def rss():
+    """Current resident set size of this process in bytes, or None."""
+
+    try:
+        with open("/proc/self/statm") as file_:
+            return int(file_.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None."""
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(int(round(pct / 100.0 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def mean(values):
+    return statistics.mean(values) if values else 0.0
+
+
+def format_bytes(num):
+    if num is None:
+        return "n/a"
+    for unit in ("B", "KiB", "MiB"):
+        if abs(num) < 1024:
+            return "%d %s" % (num, unit)
+        num /= 1024.0
+    return "%.1f GiB" % num
+
+
+def print_table(headers, rows):
+    """Print rows as a plain text table with right-aligned numbers."""
+
+    def fmt(value):
+        if isinstance(value, float):
+            return "%.2f" % value
+        return str(value)
+
+    text_rows = [[fmt(v) for v in row] for row in rows]
+    widths = [
+        max([len(h)] + [len(r[i]) for r in text_rows])
+        for i, h in enumerate(headers)
+    ]
+    print("  ".join(h.rjust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in text_rows:
+        print("  ".join(v.rjust(w) for v, w in zip(row, widths)))
+
+
+@contextlib.contextmanager
+def database_url(kind):
+    """Yield a SQLite URL for ``kind``, either "memory" or "file".
+
+    File databases are created in a temporary directory that's removed
+    afterwards.
+
+    """
+    if kind == "memory":
+        yield "sqlite://"
+    elif kind == "file":
+        with tempfile.TemporaryDirectory() as tmpdir:
+            yield "sqlite:///%s" % os.path.join(tmpdir, "bench.db")
+    else:
+        raise ValueError("kind must be 'memory' or 'file'")
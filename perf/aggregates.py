@@ -0,0 +1,223 @@
+"""Ways of finding "users with more than one email address".
+
+``04_selects.py`` counts addresses per user in a GROUP BY / HAVING
+subquery and joins that back to ``User``.  Each function here returns a
+``select()`` of ``(name, email_count)`` with the same rows, written as:
+
+* :func:`subquery_join` - the statement from the slides
+* :func:`window_function` - ``count() OVER (PARTITION BY user_id)`` in a
+  DISTINCT subquery
+* :func:`correlated_subquery` - a correlated scalar subquery, selected
+  and compared in WHERE
+* :func:`exists_self_join` - addresses for which another address of the
+  same user EXISTS, grouped by user
+
+The benchmark loads users with between zero and ``2 * average``
+addresses each and reports the latency of each strategy, first without
+and then with an index on ``address.user_id``.  Without the index, the
+correlated strategies scan ``address`` once per user, so each strategy
+is abandoned after ``--timeout`` seconds::
+
+    python -m perf.aggregates --users 1000000 --addresses 5000000
+
+"""
+
+import argparse
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy import exc
+from sqlalchemy import exists
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from . import _util
+from .models import Address
+from .models import Base
+from .models import chunks
+from .models import user_rows
+from .models import User
+
+
+def subquery_join(min_count=1):
+    email_count = (
+        select(
+            Address.user_id,
+            func.count(Address.email_address).label("email_count"),
+        )
+        .group_by(Address.user_id)
+        .having(func.count(Address.email_address) > min_count)
+        .subquery()
+    )
+    return select(User.name, email_count.c.email_count).join_from(
+        User, email_count
+    )
+
+
+def window_function(min_count=1):
+    email_count = (
+        select(
+            Address.user_id,
+            func.count()
+            .over(partition_by=Address.user_id)
+            .label("email_count"),
+        )
+        .distinct()
+        .subquery()
+    )
+    return (
+        select(User.name, email_count.c.email_count)
+        .join_from(User, email_count)
+        .where(email_count.c.email_count > min_count)
+    )
+
+
+def correlated_subquery(min_count=1):
+    email_count = (
+        select(func.count(Address.id))
+        .where(Address.user_id == User.id)
+        .scalar_subquery()
+    )
+    return select(User.name, email_count.label("email_count")).where(
+        email_count > min_count
+    )
+
+
+def exists_self_join(min_count=1):
+    if min_count != 1:
+        raise ValueError("exists_self_join only supports min_count=1")
+    other = aliased(Address)
+    return (
+        select(User.name, func.count(Address.id).label("email_count"))
+        .join_from(User, Address)
+        .where(
+            exists().where(
+                other.user_id == Address.user_id, other.id != Address.id
+            )
+        )
+        .group_by(User.id)
+    )
+
+
+strategies = {
+    "subquery_join": subquery_join,
+    "window_function": window_function,
+    "correlated_subquery": correlated_subquery,
+    "exists_self_join": exists_self_join,
+}
+
+
+def _address_rows(num_users, average):
+    # user n gets n % (2 * average + 1) addresses
+    spread = 2 * average + 1
+    for user_id in range(1, num_users + 1):
+        for j in range(user_id % spread):
+            yield {
+                "user_id": user_id,
+                "email_address": "user%d.%d@example.com" % (user_id, j),
+            }
+
+
+def load(engine, num_users, num_addresses, chunk_size=10000):
+    Base.metadata.create_all(engine)
+    average = max(num_addresses // max(num_users, 1), 1)
+    with engine.begin() as conn:
+        for chunk in chunks(user_rows(num_users), chunk_size):
+            conn.execute(insert(User), chunk)
+        total = 0
+        for chunk in chunks(_address_rows(num_users, average), chunk_size):
+            conn.execute(insert(Address), chunk)
+            total += len(chunk)
+    return total
+
+
+def _latency(conn, stmt, repeat, timeout):
+    """Median seconds and sorted rows, or ``(None, None)`` if a run takes
+    longer than ``timeout`` seconds."""
+
+    dbapi_connection = conn.connection.dbapi_connection
+    timings = []
+    rows = None
+    for i in range(repeat):
+        now = time.perf_counter()
+        deadline = now + timeout
+        # SQLite calls this every 10000 VM instructions; returning true
+        # interrupts the query
+        dbapi_connection.set_progress_handler(
+            lambda: time.perf_counter() > deadline, 10000
+        )
+        try:
+            rows = conn.execute(stmt).all()
+        except exc.OperationalError:
+            if time.perf_counter() < deadline:
+                raise
+            return None, None
+        finally:
+            dbapi_connection.set_progress_handler(None, 0)
+        timings.append(time.perf_counter() - now)
+    return _util.percentile(timings, 50), sorted(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare ways of finding users with several emails."
+    )
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--addresses", type=int, default=5000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60.0,
+        help="seconds after which a strategy is abandoned",
+    )
+    parser.add_argument(
+        "--strategies",
+        nargs="+",
+        choices=list(strategies),
+        default=list(strategies),
+    )
+    options = parser.parse_args(argv)
+
+    engine = create_engine("sqlite://")
+    print("Loading %d users..." % options.users)
+    total = load(engine, options.users, options.addresses)
+    print("Loaded %d addresses" % total)
+
+    rows = []
+    expected = None
+    with engine.connect() as conn:
+        for indexed in (False, True):
+            if indexed:
+                conn.exec_driver_sql(
+                    "CREATE INDEX ix_address_user_id ON address (user_id)"
+                )
+            for name in options.strategies:
+                elapsed, result = _latency(
+                    conn, strategies[name](), options.repeat, options.timeout
+                )
+                if result is None:
+                    rows.append(
+                        ["yes" if indexed else "no", name, "timeout", "", ""]
+                    )
+                    continue
+                if expected is None:
+                    expected = result
+                rows.append(
+                    [
+                        "yes" if indexed else "no",
+                        name,
+                        elapsed * 1000,
+                        len(result),
+                        "" if result == expected else "MISMATCH",
+                    ]
+                )
+        conn.rollback()
+
+    _util.print_table(["index", "strategy", "ms", "rows", "check"], rows)
+
+
+if __name__ == "__main__":
+    main()
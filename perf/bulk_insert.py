@@ -0,0 +1,139 @@
+"""Generator-fed executemany for ``text()`` INSERT statements.
+
+``01_engine_usage.py`` inserts into ``employee`` one parameter dictionary
+at a time.  :func:`execute_chunked` accepts any iterator of parameter
+dictionaries instead, and runs it as a series of executemany batches,
+committing after each one, without ever building the full list::
+
+    with engine.connect() as conn:
+        execute_chunked(conn, insert_stmt, generate_params(), 10000)
+
+The benchmark compares per-row ``execute()`` with chunked executemany::
+
+    python -m perf.bulk_insert --rows 1000000 --chunk-size 10000
+
+"""
+
+import argparse
+
+from sqlalchemy import create_engine
+from sqlalchemy import text
+
+from . import _util
+from .models import chunks
+
+
+create_table = text(
+    "create table employee "
+    "(emp_id integer primary key, emp_name varchar, fullname varchar)"
+)
+insert_stmt = text(
+    "insert into employee(emp_name, fullname) values (:name, :fullname)"
+)
+
+
+def execute_chunked(connection, statement, params, chunk_size=10000):
+    """Execute ``statement`` for each dictionary in the iterable
+    ``params``, ``chunk_size`` at a time, committing after each chunk.
+
+    Only one chunk of parameters is held in memory at once.  Returns the
+    number of parameter sets executed.
+
+    """
+    total = 0
+    for chunk in chunks(params, chunk_size):
+        connection.execute(statement, chunk)
+        connection.commit()
+        total += len(chunk)
+    return total
+
+
+def generate_params(count):
+    for i in range(count):
+        yield {"name": "emp%d" % i, "fullname": "Employee Number %d" % i}
+
+
+def per_row(connection, count, chunk_size):
+    for i, params in enumerate(generate_params(count), 1):
+        connection.execute(insert_stmt, params)
+        if not i % chunk_size:
+            connection.commit()
+    connection.commit()
+
+
+def chunked(connection, count, chunk_size):
+    execute_chunked(
+        connection, insert_stmt, generate_params(count), chunk_size
+    )
+
+
+strategies = {"per_row": per_row, "chunked": chunked}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare per-row execute() with chunked executemany."
+    )
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument(
+        "--databases",
+        nargs="+",
+        choices=["memory", "file"],
+        default=["memory", "file"],
+    )
+    parser.add_argument(
+        "--strategies",
+        nargs="+",
+        choices=list(strategies),
+        default=list(strategies),
+    )
+    options = parser.parse_args(argv)
+
+    rows = []
+    for database in options.databases:
+        for name in options.strategies:
+            with _util.database_url(database) as url:
+                engine = create_engine(url)
+                with engine.connect() as conn:
+                    conn.execute(create_table)
+                    conn.commit()
+
+                    baseline = _util.rss()
+                    with _util.measure(engine) as m:
+                        strategies[name](
+                            conn, options.rows, options.chunk_size
+                        )
+                    growth = _util.rss()
+                    if None not in (growth, baseline):
+                        growth -= baseline
+                engine.dispose()
+
+            rows.append(
+                [
+                    database,
+                    name,
+                    options.rows,
+                    m.elapsed,
+                    options.rows / m.elapsed,
+                    m.statements,
+                    _util.format_bytes(growth),
+                ]
+            )
+
+    _util.print_table(
+        [
+            "database",
+            "strategy",
+            "rows",
+            "seconds",
+            "rows/sec",
+            "statements",
+            "rss growth",
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""Fetch results into column arrays, without ``Row`` objects.
+
+Each ``Result`` in ``04_selects.py`` builds one ``Row`` per database row
+and runs type processors value by value.  For analytics over a couple
+of columns, such as ``User.id`` and ``User.created_at``,
+:func:`columns_from_result` reads batches straight from the DBAPI
+cursor, transposes them, and appends each column to an ``array.array``,
+or to NumPy arrays when ``use_numpy=True`` and NumPy is installed::
+
+    result = conn.execute(select(User.id, User.created_at))
+    columns = columns_from_result(result)
+    columns["id"]          # array('q', [...])
+    columns["created_at"]  # array('d', [...]) of POSIX timestamps
+
+Columns are stored according to their SQL type:
+
+* integers as ``'q'`` arrays / ``int64``; NULL isn't supported
+* floats and numerics as ``'d'`` arrays / ``float64``, NULL as NaN
+* booleans as ``'b'`` arrays / ``bool``; NULL isn't supported
+* datetimes as ``'d'`` arrays of POSIX timestamps, naive values taken
+  as UTC, or ``datetime64[us]`` with NumPy; NULL as NaN / NaT
+* anything else as a list, with the type's result processor applied
+
+The per-value type processors are replaced with a conversion over each
+column of a batch; on SQLite, NumPy parses datetime strings for a whole
+batch in one call.  A result executed with ``yield_per`` or
+``stream_results`` has already buffered rows from the cursor, so it's
+read through ``Result.partitions()`` instead, Row objects and all.
+
+The benchmark compares time and memory with ``result.all()`` and
+``result.scalars().all()``, each in a fresh process::
+
+    python -m perf.columnar --rows 10000000
+
+"""
+
+import argparse
+import array
+import concurrent.futures
+import datetime
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy import select
+from sqlalchemy import types as sqltypes
+from sqlalchemy.engine.cursor import CursorFetchStrategy
+
+from . import _util
+from .models import populate
+from .models import User
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+_epoch = datetime.datetime(1970, 1, 1)
+_nan = float("nan")
+
+
+def _timestamp(value):
+    if value is None:
+        return _nan
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        return value.timestamp()
+    return (value - _epoch).total_seconds()
+
+
+class _ColumnBuffer(object):
+    """Accumulates one column's values, batch by batch."""
+
+    def __init__(self, name, type_, dialect, use_numpy, processed=False):
+        self.name = name
+        self.use_numpy = use_numpy
+        self.processor = None
+        affinity = getattr(type_, "_type_affinity", None)
+
+        if affinity is not None and issubclass(affinity, sqltypes.Boolean):
+            self.kind = "bool"
+        elif affinity is not None and issubclass(
+            affinity, sqltypes.Integer
+        ):
+            self.kind = "int"
+        elif affinity is not None and issubclass(
+            affinity, (sqltypes.Float, sqltypes.Numeric)
+        ):
+            self.kind = "float"
+        elif affinity is not None and issubclass(
+            affinity, sqltypes.DateTime
+        ):
+            self.kind = "datetime"
+        else:
+            self.kind = "object"
+            if type_ is not None and not processed:
+                self.processor = type_.result_processor(dialect, None)
+
+        if use_numpy and self.kind != "object":
+            self.data = []
+        elif self.kind == "int":
+            self.data = array.array("q")
+        elif self.kind == "bool":
+            self.data = array.array("b")
+        elif self.kind in ("float", "datetime"):
+            self.data = array.array("d")
+        else:
+            self.data = []
+
+    def extend(self, values):
+        kind = self.kind
+        if kind == "object":
+            if self.processor is not None:
+                values = map(self.processor, values)
+            self.data.extend(values)
+        elif self.use_numpy:
+            self.data.append(self._numpy_batch(values))
+        elif kind == "datetime":
+            # timestamps often repeat within a batch, e.g. rows inserted
+            # together with a server default; convert each distinct one
+            converted = {value: _timestamp(value) for value in set(values)}
+            self.data.extend(map(converted.__getitem__, values))
+        else:
+            size = len(self.data)
+            try:
+                self.data.extend(values)
+            except TypeError:
+                # extend() keeps what it appended before the NULL
+                del self.data[size:]
+                if kind != "float":
+                    raise ValueError(
+                        "NULL in %s column %r" % (kind, self.name)
+                    )
+                self.data.extend(
+                    _nan if value is None else value for value in values
+                )
+
+    def _numpy_batch(self, values):
+        kind = self.kind
+        if kind == "datetime":
+            return numpy.array(values, dtype="datetime64[us]")
+        elif kind == "int":
+            try:
+                return numpy.array(values, dtype=numpy.int64)
+            except TypeError:
+                raise ValueError("NULL in int column %r" % self.name)
+        elif kind == "bool":
+            # NumPy would take None as False
+            if None in values:
+                raise ValueError("NULL in bool column %r" % self.name)
+            return numpy.array(values, dtype=numpy.bool_)
+        else:
+            return numpy.array(values, dtype=numpy.float64)
+
+    def finish(self):
+        if self.use_numpy and self.kind != "object":
+            if not self.data:
+                return numpy.array(
+                    [],
+                    dtype={
+                        "int": numpy.int64,
+                        "bool": numpy.bool_,
+                        "float": numpy.float64,
+                        "datetime": "datetime64[us]",
+                    }[self.kind],
+                )
+            return numpy.concatenate(self.data)
+        return self.data
+
+
+def _cursor_batches(cursor, batch_size):
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        yield batch
+
+
+def columns_from_result(result, batch_size=10000, use_numpy=False):
+    """Consume ``result``, a ``CursorResult`` from
+    ``Connection.execute()``, returning a dictionary of column arrays
+    keyed by column name.
+
+    Rows already fetched from ``result`` aren't included.  With a
+    ``Session``, execute against ``session.connection()``.
+
+    """
+    if use_numpy and numpy is None:
+        raise ImportError("use_numpy=True requires NumPy")
+
+    keys = list(result.keys())
+    compiled = result.context.compiled
+    statement = compiled.statement if compiled is not None else None
+    if statement is not None and hasattr(statement, "selected_columns"):
+        types = [column.type for column in statement.selected_columns]
+    else:
+        types = [None] * len(keys)
+
+    # only the plain strategy leaves every row not yet fetched from the
+    # result in the DBAPI cursor; the buffered ones used for yield_per
+    # and stream_results fetch at least one row ahead
+    raw = type(result.cursor_strategy) is CursorFetchStrategy
+
+    dialect = result.context.dialect
+    buffers = [
+        _ColumnBuffer(key, type_, dialect, use_numpy, processed=not raw)
+        for key, type_ in zip(keys, types)
+    ]
+
+    if raw:
+        batches = _cursor_batches(result.cursor, batch_size)
+    else:
+        batches = result.partitions(batch_size)
+    try:
+        for batch in batches:
+            for buffer, values in zip(buffers, zip(*batch)):
+                buffer.extend(values)
+    finally:
+        result.close()
+    return {buffer.name: buffer.finish() for buffer in buffers}
+
+
+def fetch_columns(connection, statement, batch_size=10000, use_numpy=False):
+    """Execute ``statement`` and return its columns as arrays."""
+
+    return columns_from_result(
+        connection.execute(statement), batch_size, use_numpy
+    )
+
+
+def _rows_all(conn):
+    return conn.execute(select(User.id, User.created_at)).all()
+
+
+def _scalars_all(conn):
+    return conn.execute(select(User.id)).scalars().all()
+
+
+def _columnar(conn):
+    return fetch_columns(conn, select(User.id, User.created_at))
+
+
+def _columnar_id(conn):
+    return fetch_columns(conn, select(User.id))
+
+
+def _columnar_numpy(conn):
+    return fetch_columns(
+        conn, select(User.id, User.created_at), use_numpy=True
+    )
+
+
+strategies = {
+    "rows_all": _rows_all,
+    "scalars_all": _scalars_all,
+    "columnar": _columnar,
+    "columnar_id": _columnar_id,
+    "columnar_numpy": _columnar_numpy,
+}
+
+
+def run_strategy(url, name):
+    """Run in a fresh process; returns (seconds, memory)."""
+
+    engine = create_engine(url)
+    baseline = _util.rss()
+    with engine.connect() as conn:
+        now = time.perf_counter()
+        result = strategies[name](conn)
+        elapsed = time.perf_counter() - now
+    peak = _util.peak_rss()
+    del result
+    engine.dispose()
+    return elapsed, peak - baseline if None not in (peak, baseline) else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare columnar fetching with Row-based results."
+    )
+    parser.add_argument("--rows", type=int, default=10000000)
+    available = [
+        name
+        for name in strategies
+        if numpy is not None or name != "columnar_numpy"
+    ]
+    parser.add_argument(
+        "--strategies", nargs="+", choices=available, default=available
+    )
+    options = parser.parse_args(argv)
+    if numpy is None:
+        print("NumPy isn't installed; skipping columnar_numpy")
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        url = "sqlite:///%s" % os.path.join(tmpdir, "columnar.db")
+        engine = create_engine(url)
+        print("Loading %d rows..." % options.rows)
+        populate(engine, options.rows)
+        engine.dispose()
+
+        for name in options.strategies:
+            with concurrent.futures.ProcessPoolExecutor(1) as executor:
+                elapsed, memory = executor.submit(
+                    run_strategy, url, name
+                ).result()
+            rows.append(
+                [
+                    name,
+                    elapsed,
+                    options.rows / elapsed,
+                    _util.format_bytes(memory),
+                ]
+            )
+
+    _util.print_table(["strategy", "seconds", "rows/sec", "peak mem"], rows)
+
+
+if __name__ == "__main__":
+    main()
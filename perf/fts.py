@@ -0,0 +1,328 @@
+"""Full-text search over ``User`` and ``Address`` with SQLite FTS5.
+
+``User.name.icontains("spongebob")`` in ``04_selects.py`` renders
+``lower(name) LIKE '%' || lower(?) || '%'``, which can't use an index
+and scans the table on every query.  :class:`FullTextIndex` maintains an
+FTS5 "external content" table alongside a mapped table, kept in sync by
+triggers on INSERT, UPDATE and DELETE, and produces criteria for
+``select().where()``::
+
+    user_search = FullTextIndex(User.__table__, ["name", "fullname"])
+    user_search.listen()  # create / drop along with user_account
+
+    stmt = select(User).where(user_search.contains("spongebob"))
+    stmt = select(User).where(user_search.match("sponge* OR sandy"))
+
+The default ``trigram`` tokenizer (SQLite 3.34 and later) makes
+:meth:`FullTextIndex.contains` a case-insensitive substring match like
+``icontains()``; trigrams can't match search strings shorter than three
+characters, so for those it falls back to ``icontains()`` itself.
+:meth:`FullTextIndex.match` takes FTS5 query syntax.  Indexes on tables
+that already have rows are filled with :meth:`FullTextIndex.rebuild`,
+which is also faster than the triggers for an initial bulk load.
+
+The benchmark loads users and addresses, then compares ``icontains()``
+with the FTS table for several search strings, along with the cost of
+the triggers on the load::
+
+    python -m perf.fts --users 1000000
+
+"""
+
+import argparse
+import time
+
+from sqlalchemy import Column
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import or_
+from sqlalchemy import select
+from sqlalchemy import Table
+from sqlalchemy import update
+
+from . import _util
+from .models import Address
+from .models import Base
+from .models import populate
+from .models import User
+
+
+def fts5_available(connection):
+    """Return True if the SQLite library was built with FTS5."""
+
+    return bool(
+        connection.exec_driver_sql(
+            "SELECT sqlite_compileoption_used('ENABLE_FTS5')"
+        ).scalar()
+    )
+
+
+class FullTextIndex(object):
+    """An FTS5 table indexing ``columns`` of ``table``.
+
+    ``table`` must have a single integer primary key, which becomes the
+    FTS5 ``rowid``.
+
+    """
+
+    def __init__(self, table, columns, tokenize="trigram", name=None):
+        self.table = table
+        self.columns = list(columns)
+        self.tokenize = tokenize
+        self.name = name or "%s_fts" % table.name
+        (self.key,) = table.primary_key.columns
+
+        # describes the virtual table, for building criteria; it isn't
+        # part of any application MetaData
+        self.fts_table = Table(
+            self.name,
+            MetaData(),
+            Column("rowid", Integer),
+            Column(self.name),
+            *[Column(name) for name in self.columns],
+        )
+
+    def _ddl(self):
+        names = ", ".join(self.columns)
+        new = ", ".join("new.%s" % name for name in self.columns)
+        old = ", ".join("old.%s" % name for name in self.columns)
+        params = {
+            "fts": self.name,
+            "table": self.table.name,
+            "key": self.key.name,
+            "names": names,
+            "new": new,
+            "old": old,
+            "tokenize": self.tokenize,
+        }
+        return [
+            "CREATE VIRTUAL TABLE %(fts)s USING fts5(%(names)s, "
+            "content='%(table)s', content_rowid='%(key)s', "
+            "tokenize='%(tokenize)s')" % params,
+            "CREATE TRIGGER %(fts)s_ai AFTER INSERT ON %(table)s BEGIN "
+            "INSERT INTO %(fts)s (rowid, %(names)s) "
+            "VALUES (new.%(key)s, %(new)s); END" % params,
+            "CREATE TRIGGER %(fts)s_ad AFTER DELETE ON %(table)s BEGIN "
+            "INSERT INTO %(fts)s (%(fts)s, rowid, %(names)s) "
+            "VALUES ('delete', old.%(key)s, %(old)s); END" % params,
+            "CREATE TRIGGER %(fts)s_au AFTER UPDATE OF %(names)s "
+            "ON %(table)s BEGIN "
+            "INSERT INTO %(fts)s (%(fts)s, rowid, %(names)s) "
+            "VALUES ('delete', old.%(key)s, %(old)s); "
+            "INSERT INTO %(fts)s (rowid, %(names)s) "
+            "VALUES (new.%(key)s, %(new)s); END" % params,
+        ]
+
+    def create(self, connection):
+        """Create the FTS table and triggers; existing rows aren't
+        indexed until :meth:`rebuild` is called."""
+
+        for ddl in self._ddl():
+            connection.exec_driver_sql(ddl)
+
+    def drop(self, connection):
+        for suffix in ("_ai", "_ad", "_au"):
+            connection.exec_driver_sql(
+                "DROP TRIGGER IF EXISTS %s%s" % (self.name, suffix)
+            )
+        connection.exec_driver_sql("DROP TABLE IF EXISTS %s" % self.name)
+
+    def rebuild(self, connection):
+        """Re-index every row of the content table."""
+
+        connection.exec_driver_sql(
+            "INSERT INTO %s (%s) VALUES ('rebuild')" % (self.name, self.name)
+        )
+
+    def listen(self):
+        """Create and drop the FTS table along with ``table``."""
+
+        event.listen(
+            self.table,
+            "after_create",
+            lambda target, connection, **kw: self.create(connection),
+        )
+        event.listen(
+            self.table,
+            "before_drop",
+            lambda target, connection, **kw: self.drop(connection),
+        )
+
+    def match(self, query, column=None):
+        """Criterion for rows matching the FTS5 ``query``, in all
+        columns or only ``column``."""
+
+        fts = self.fts_table
+        target = fts.c[column if column is not None else self.name]
+        return self.key.in_(select(fts.c.rowid).where(target.match(query)))
+
+    def contains(self, text, column=None):
+        """Criterion for rows containing ``text`` anywhere, as a quoted
+        FTS5 phrase; a substring match with the ``trigram`` tokenizer.
+
+        With ``trigram``, ``text`` shorter than three characters is
+        searched with ``icontains()`` instead, scanning the table.
+
+        """
+        if self.tokenize == "trigram" and len(text) < 3:
+            names = [column] if column is not None else self.columns
+            return or_(*[self.table.c[name].icontains(text) for name in names])
+        return self.match('"%s"' % text.replace('"', '""'), column)
+
+
+user_search = FullTextIndex(User.__table__, ["name", "fullname"])
+address_search = FullTextIndex(Address.__table__, ["email_address"])
+
+
+def _load(num_users, addresses_per_user, indexes, rebuild=False):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    now = time.perf_counter()
+    if rebuild:
+        populate(engine, num_users, addresses_per_user)
+    with engine.begin() as conn:
+        for index in indexes:
+            index.create(conn)
+            if rebuild:
+                index.rebuild(conn)
+    if not rebuild:
+        populate(engine, num_users, addresses_per_user)
+    return engine, time.perf_counter() - now
+
+
+def _latency(conn, stmt, repeat):
+    timings = []
+    for i in range(repeat):
+        now = time.perf_counter()
+        rows = conn.execute(stmt).all()
+        timings.append(time.perf_counter() - now)
+    return _util.percentile(timings, 50), sorted(rows)
+
+
+def _check_sync(conn):
+    """Update and delete a user, and check the FTS table follows."""
+
+    conn.execute(update(User).where(User.id == 1).values(name="xyzzy plugh"))
+    found = conn.scalars(
+        select(User.id).where(user_search.contains("zzy plu"))
+    ).all()
+    conn.exec_driver_sql("DELETE FROM address WHERE user_id = 2")
+    conn.exec_driver_sql("DELETE FROM user_account WHERE id = 2")
+    gone = conn.scalars(
+        select(User.id).where(user_search.contains("user1"), User.id == 2)
+    ).all()
+    conn.rollback()
+    return found == [1] and gone == []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare FTS5 search with icontains()."
+    )
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--addresses-per-user", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--search",
+        nargs="+",
+        default=["user12345", "Number 4242", "99999", ".0@example"],
+    )
+    options = parser.parse_args(argv)
+
+    with create_engine("sqlite://").connect() as conn:
+        if not fts5_available(conn):
+            print("SQLite was built without FTS5")
+            return
+
+    print("Loading without FTS...")
+    plain_engine, plain_load = _load(
+        options.users, options.addresses_per_user, []
+    )
+    plain_engine.dispose()
+
+    print("Loading, then rebuilding FTS...")
+    rebuild_engine, rebuild_load = _load(
+        options.users,
+        options.addresses_per_user,
+        [user_search, address_search],
+        rebuild=True,
+    )
+    rebuild_engine.dispose()
+
+    print("Loading with FTS...")
+    engine, fts_load = _load(
+        options.users,
+        options.addresses_per_user,
+        [user_search, address_search],
+    )
+    print(
+        "load: %.2f s without FTS, %.2f s with FTS triggers, "
+        "%.2f s loading then rebuilding" % (plain_load, fts_load, rebuild_load)
+    )
+
+    rows = []
+    with engine.connect() as conn:
+        for text in options.search:
+            for label, entity, like_criteria, fts_criteria in [
+                (
+                    "User name / fullname",
+                    User,
+                    or_(
+                        User.name.icontains(text),
+                        User.fullname.icontains(text),
+                    ),
+                    user_search.contains(text),
+                ),
+                (
+                    "Address email_address",
+                    Address,
+                    Address.email_address.icontains(text),
+                    address_search.contains(text),
+                ),
+            ]:
+                like, expected = _latency(
+                    conn,
+                    select(entity.id).where(like_criteria),
+                    options.repeat,
+                )
+                fts, result = _latency(
+                    conn, select(entity.id).where(fts_criteria), options.repeat
+                )
+                rows.append(
+                    [
+                        label,
+                        text,
+                        len(expected),
+                        like * 1000,
+                        fts * 1000,
+                        like / fts if fts else 0.0,
+                        "" if result == expected else "MISMATCH",
+                    ]
+                )
+
+        total = conn.scalar(select(func.count()).select_from(User))
+        in_sync = _check_sync(conn)
+
+    _util.print_table(
+        [
+            "column",
+            "search",
+            "rows",
+            "icontains ms",
+            "fts ms",
+            "speedup",
+            "check",
+        ],
+        rows,
+    )
+    print(
+        "\n%d users; update / delete sync %s"
+        % (total, "ok" if in_sync else "FAILED")
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Strategies for IN filters with very large lists of keys.
+
+``04_selects.py`` filters with ``User.name.in_(["spongebob", "sandy",
+"krabs"])``.  With tens or hundreds of thousands of keys, an expanding
+IN renders one bound parameter per key, which runs into SQLite's limit
+on bound parameters (999 before SQLite 3.32, 32766 after, or whatever
+the build sets) and makes each statement expensive to render.
+:func:`in_filter` produces the criterion using one of four strategies:
+
+* ``expanding`` - ``column.in_(values)``, one bound parameter per key
+* ``literal`` - an expanding parameter with ``literal_execute=True``,
+  rendering the keys inline into the SQL, so no parameter limit applies
+* ``chunked`` - ``OR`` of several expanding INs of ``chunk_size`` keys,
+  for backends that limit the size of a single IN list; all the keys are
+  still bound parameters
+* ``temp_table`` - the keys are inserted into a temporary table, and
+  the criterion is ``column IN (SELECT key FROM temp_table)``
+
+When no strategy is given, :func:`choose_strategy` picks one from the
+number of keys, the connection's parameter limit and whether the column
+is indexed; ``chunked`` is never chosen, since SQLite doesn't limit the
+size of an IN list itself and it's no faster than ``expanding``.  Since
+temporary tables belong to a single DBAPI connection, pass
+``session.connection()`` rather than a ``Session``::
+
+    with in_filter(conn, User.name, names) as criterion:
+        rows = conn.execute(select(User.id).where(criterion)).all()
+
+The benchmark reports, for each strategy and list size, the time taken
+to set up the criterion, to compile (including rendering expanded or
+literal parameters) and to execute, against ``user_account.name``
+with or without an index::
+
+    python -m perf.in_lists --users 1000000 --sizes 10 1000 10000 500000
+    python -m perf.in_lists --users 1000000 --index
+
+"""
+
+import argparse
+import contextlib
+import itertools
+import sqlite3
+import time
+
+from sqlalchemy import bindparam
+from sqlalchemy import Column
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import exc
+from sqlalchemy import Index
+from sqlalchemy import MetaData
+from sqlalchemy import or_
+from sqlalchemy import select
+from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy import UniqueConstraint
+
+from . import _util
+from .models import chunks
+from .models import populate
+from .models import User
+
+
+strategies = ["expanding", "literal", "chunked", "temp_table"]
+
+# The choices below come from the benchmark (median of 5 runs, SQLite
+# 3.40.1, Python 3.11, SQLAlchemy 2.1, in-memory database of 300k and
+# 1M users).  With an index on the column, expanding and literal stay
+# within about 10% of each other from 10 up to 150k keys, and the temp
+# table is never faster.  Without one, every strategy scans the table
+# and the temp table's IN (SELECT ...) scans it about a third faster at
+# any size, until inserting the keys costs more than that saves, at
+# around a third of the table's rows; the size of the table isn't
+# known here, so that case isn't handled.
+
+# up to this many keys against an indexed column, a plain expanding IN
+# is as fast as literal and lets the statement's compiled form be cached
+expanding_threshold = 1000
+
+_temp_names = itertools.count(1)
+
+
+def parameter_limit(connection):
+    """The maximum number of bound parameters per statement for a SQLite
+    ``connection``."""
+
+    dbapi_connection = connection.connection.dbapi_connection
+    getlimit = getattr(dbapi_connection, "getlimit", None)
+    if getlimit is not None:
+        return getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    return 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+
+def choose_strategy(size, limit, indexed=True):
+    """Pick a strategy for ``size`` keys given a parameter ``limit`` and
+    whether the column is ``indexed``."""
+
+    if not indexed:
+        return "temp_table"
+    elif size <= min(expanding_threshold, limit):
+        return "expanding"
+    else:
+        return "literal"
+
+
+def is_indexed(column):
+    """Whether ``column`` leads an index, unique constraint or primary key
+    declared on its table's metadata.
+
+    Indexes that exist only in the database aren't seen; neither are
+    those on expressions, which are taken as not indexed.
+
+    """
+    column = getattr(column, "expression", column)
+    table = getattr(column, "table", None)
+    if not isinstance(table, Table):
+        return False
+    if column.index or column.unique or column.primary_key:
+        return True
+    for constraint in list(table.indexes) + list(table.constraints):
+        if isinstance(constraint, (Index, UniqueConstraint)):
+            leading = list(constraint.columns)[:1]
+            if leading and leading[0].key == column.key:
+                return True
+    return False
+
+
+@contextlib.contextmanager
+def in_filter(connection, column, values, strategy=None, chunk_size=1000):
+    """Yield a criterion for ``column IN values``.
+
+    The ``temp_table`` strategy's table is dropped when the block exits.
+
+    """
+    values = list(values)
+    if strategy is None:
+        strategy = choose_strategy(
+            len(values), parameter_limit(connection), is_indexed(column)
+        )
+
+    if strategy == "expanding":
+        yield column.in_(values)
+    elif strategy == "literal":
+        yield column.in_(
+            bindparam(
+                "in_keys",
+                values,
+                expanding=True,
+                literal_execute=True,
+                unique=True,
+            )
+        )
+    elif strategy == "chunked":
+        yield or_(
+            *[column.in_(chunk) for chunk in chunks(values, chunk_size)]
+        )
+    elif strategy == "temp_table":
+        table = Table(
+            "_in_keys_%d" % next(_temp_names),
+            MetaData(),
+            Column("key", column.type, primary_key=True),
+            prefixes=["TEMPORARY"],
+        )
+        table.create(connection)
+        try:
+            # the DBAPI's executemany with plain tuples; this is the
+            # bulk of the strategy's cost.  duplicate keys are fine for
+            # IN, but not for the table's primary key
+            connection.exec_driver_sql(
+                "INSERT INTO %s (key) VALUES (?)" % table.name,
+                [(value,) for value in dict.fromkeys(values)],
+            )
+            yield column.in_(select(table.c.key))
+        finally:
+            table.drop(connection)
+    else:
+        raise ValueError("unknown IN strategy %r" % (strategy,))
+
+
+def _run(conn, keys, strategy, repeat):
+    """Median (setup, compile, execute) seconds and the row count, or
+    None if the statement can't be run."""
+
+    marks = {}
+
+    def before_execute(*arg):
+        marks.setdefault("sql", time.perf_counter())
+
+    timings = []
+    count = None
+    event.listen(conn, "before_cursor_execute", before_execute)
+    try:
+        for i in range(repeat):
+            start = time.perf_counter()
+            with in_filter(conn, User.name, keys, strategy) as criterion:
+                ready = time.perf_counter()
+                marks.clear()
+                try:
+                    count = len(
+                        conn.execute(select(User.id).where(criterion)).all()
+                    )
+                except exc.OperationalError:
+                    return None
+                done = time.perf_counter()
+            timings.append(
+                (ready - start, marks["sql"] - ready, done - marks["sql"])
+            )
+    finally:
+        event.remove(conn, "before_cursor_execute", before_execute)
+
+    return [
+        _util.percentile([t[i] for t in timings], 50) for i in range(3)
+    ] + [count]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare strategies for IN filters with many keys."
+    )
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 10000, 50000, 100000, 500000],
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="index user_account.name; the IN strategies compare very "
+        "differently with and without one",
+    )
+    parser.add_argument(
+        "--strategies", nargs="+", choices=strategies, default=strategies
+    )
+    options = parser.parse_args(argv)
+
+    engine = create_engine("sqlite://")
+    print("Loading %d users..." % options.users)
+    populate(engine, options.users)
+    if options.index:
+        # on a table of its own, so the index isn't added to User's
+        name_index = Index("ix_in_lists_name", "name")
+        Table("user_account", MetaData(), Column("name", String), name_index)
+        with engine.begin() as conn:
+            name_index.create(conn)
+
+    rows = []
+    with engine.connect() as conn:
+        limit = parameter_limit(conn)
+        for size in options.sizes:
+            # every other user's name, all of which exist as long as
+            # --users is at least twice the size
+            keys = ["user%d" % (i * 2) for i in range(size)]
+            for strategy in options.strategies:
+                result = _run(conn, keys, strategy, options.repeat)
+                if result is None:
+                    rows.append([size, strategy, "", "", "", "", "error"])
+                    continue
+                setup, compile_, execute, count = result
+                rows.append(
+                    [
+                        size,
+                        strategy,
+                        setup * 1000,
+                        compile_ * 1000,
+                        execute * 1000,
+                        (setup + compile_ + execute) * 1000,
+                        count,
+                    ]
+                )
+            rows.append(
+                [
+                    size,
+                    "(chosen)",
+                    "",
+                    "",
+                    "",
+                    "",
+                    choose_strategy(size, limit, options.index),
+                ]
+            )
+
+    print("bound parameter limit: %d" % limit)
+    _util.print_table(
+        [
+            "keys",
+            "strategy",
+            "setup ms",
+            "compile ms",
+            "execute ms",
+            "total ms",
+            "rows",
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
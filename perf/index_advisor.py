@@ -0,0 +1,393 @@
+"""Suggest indexes from a captured query workload.
+
+:class:`WorkloadRecorder` listens on an engine and keeps each distinct
+SQL string it executes, with the parameters of its first execution and
+the statement construct it was compiled from.  :func:`analyze` then runs
+``EXPLAIN QUERY PLAN`` on each of them, flags full table scans and
+temporary B-trees built for GROUP BY / ORDER BY, and proposes indexes
+on the columns those statements compare, join or group on::
+
+    recorder = WorkloadRecorder(engine)
+    with recorder:
+        run_the_workload()
+
+    with engine.connect() as conn:
+        shapes = analyze(conn, recorder, Base.metadata)
+    for suggestion in suggest_indexes(shapes):
+        print(index_source(suggestion, Base))
+
+Suggestions are ``(table name, column name)`` pairs rather than
+``Index`` objects, since an ``Index`` on a table's columns attaches
+itself to that table, and would be created by every later
+``create_all()``.  :func:`make_index` builds one against a given
+``MetaData``, such as a copy made with ``Table.to_metadata()``.
+
+The benchmark records the ``04_selects.py`` queries from
+:mod:`perf.statement_cache` against a scaled dataset, prints the plans
+and suggestions, then creates the suggested indexes and measures each
+query's latency before and after::
+
+    python -m perf.index_advisor --users 1000000 --addresses-per-user 5
+
+Plan details are parsed from SQLite's ``EXPLAIN QUERY PLAN`` text, and
+a statement's candidate columns are found by walking its construct, so
+only statements executed from SQLAlchemy constructs get suggestions.
+
+"""
+
+import argparse
+import re
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import Index
+from sqlalchemy import MetaData
+from sqlalchemy import UniqueConstraint
+from sqlalchemy.sql import operators
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.elements import BinaryExpression
+from sqlalchemy.sql.schema import Column
+
+from . import _util
+from .models import Base
+from .models import populate
+from .statement_cache import queries
+
+
+_scan = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?(.*)$")
+_automatic = re.compile(
+    r"^SEARCH (?:TABLE )?(\w+)(?: AS \w+)? "
+    r"USING AUTOMATIC (?:COVERING )?INDEX \((\w+)"
+)
+_temp_btree = re.compile(r"^USE TEMP B-TREE FOR (.*)$")
+
+_explainable = ("SELECT", "WITH", "UPDATE", "DELETE")
+
+
+class StatementShape(object):
+    """A distinct SQL string seen by :class:`WorkloadRecorder`."""
+
+    __slots__ = (
+        "sql",
+        "parameters",
+        "statement",
+        "count",
+        "plan",
+        "full_scans",
+        "temp_btrees",
+        "candidates",
+    )
+
+    def __init__(self, sql, parameters, statement):
+        self.sql = sql
+        self.parameters = parameters
+        self.statement = statement
+        self.count = 0
+        self.plan = []
+        self.full_scans = []
+        self.temp_btrees = []
+        self.candidates = []
+
+    @property
+    def flagged(self):
+        return bool(self.full_scans or self.temp_btrees)
+
+
+class WorkloadRecorder(object):
+    """Records the distinct statements executed by an engine.
+
+    Use as a context manager, or call :meth:`install` /
+    :meth:`uninstall`.  Executemany statements aren't recorded.
+
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.shapes = {}
+
+    def install(self):
+        event.listen(
+            self.engine, "before_cursor_execute", self._before_execute
+        )
+
+    def uninstall(self):
+        event.remove(
+            self.engine, "before_cursor_execute", self._before_execute
+        )
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
+
+    def _before_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        if executemany:
+            return
+        shape = self.shapes.get(statement)
+        if shape is None:
+            compiled = getattr(context, "compiled", None)
+            shape = self.shapes[statement] = StatementShape(
+                statement,
+                parameters,
+                compiled.statement if compiled is not None else None,
+            )
+        shape.count += 1
+
+
+def explain(connection, sql, parameters=()):
+    """Return the ``detail`` column of ``EXPLAIN QUERY PLAN`` for
+    ``sql``."""
+
+    return [
+        row[-1]
+        for row in connection.exec_driver_sql(
+            "EXPLAIN QUERY PLAN %s" % sql, parameters
+        )
+    ]
+
+
+def _indexed_columns(table):
+    """Columns that lead an index, unique constraint or primary key."""
+
+    leading = set()
+    for index in table.indexes:
+        leading.add(index.columns[0])
+    for constraint in table.constraints:
+        if isinstance(constraint, UniqueConstraint) and constraint.columns:
+            leading.add(list(constraint.columns)[0])
+    pk = list(table.primary_key.columns)
+    if pk:
+        leading.add(pk[0])
+    for column in table.columns:
+        if column.index or column.unique:
+            leading.add(column)
+    return leading
+
+
+def _referenced_columns(statement):
+    """Columns compared, joined on or grouped by in ``statement``."""
+
+    columns = []
+
+    def add(element):
+        if isinstance(element, Column) and element not in columns:
+            columns.append(element)
+
+    for element in visitors.iterate(statement):
+        if isinstance(element, BinaryExpression) and (
+            operators.is_comparison(element.operator)
+        ):
+            add(element.left)
+            add(element.right)
+        for clause in getattr(element, "_group_by_clauses", ()):
+            add(clause)
+    return columns
+
+
+def analyze(connection, recorder, metadata):
+    """EXPLAIN each recorded shape, filling in its ``plan``,
+    ``full_scans``, ``temp_btrees`` and ``candidates``; returns the
+    shapes."""
+
+    shapes = [
+        shape
+        for shape in recorder.shapes.values()
+        if shape.sql.lstrip().upper().startswith(_explainable)
+    ]
+    for shape in shapes:
+        shape.plan = explain(connection, shape.sql, shape.parameters)
+        shape.full_scans = []
+        shape.temp_btrees = []
+        shape.candidates = []
+        scanned = set()
+        automatic = set()
+        for detail in shape.plan:
+            match = _scan.match(detail)
+            if match and "USING" not in match.group(2):
+                if match.group(1) in metadata.tables:
+                    scanned.add(match.group(1))
+                    shape.full_scans.append(match.group(1))
+                continue
+            match = _automatic.match(detail)
+            if match and match.group(1) in metadata.tables:
+                table = metadata.tables[match.group(1)]
+                automatic.add(table.c[match.group(2)])
+                scanned.add(match.group(1))
+                continue
+            match = _temp_btree.match(detail)
+            if match:
+                shape.temp_btrees.append(match.group(1))
+
+        if shape.statement is None or not shape.flagged:
+            continue
+        referenced = _referenced_columns(shape.statement)
+        if shape.temp_btrees:
+            # GROUP BY / ORDER BY against any table may use an index
+            scanned.update(
+                c.table.name
+                for c in referenced
+                if getattr(c.table, "name", None) in metadata.tables
+            )
+        for column in list(automatic) + referenced:
+            table = getattr(column, "table", None)
+            if (
+                table is None
+                or table.name not in scanned
+                or metadata.tables.get(table.name) is not table
+                or column in _indexed_columns(table)
+                or column in shape.candidates
+            ):
+                continue
+            shape.candidates.append(column)
+    return shapes
+
+
+def suggest_indexes(shapes):
+    """Return a ``(table name, column name)`` pair for each candidate
+    column of the flagged shapes, most frequently executed first."""
+
+    counts = {}
+    for shape in shapes:
+        for column in shape.candidates:
+            key = (column.table.name, column.name)
+            counts[key] = counts.get(key, 0) + shape.count
+    return sorted(counts, key=lambda key: -counts[key])
+
+
+def index_name(suggestion):
+    return "ix_%s_%s" % suggestion
+
+
+def make_index(suggestion, metadata):
+    """Return an ``Index`` for ``suggestion`` on the table of that name
+    in ``metadata``, which it becomes part of."""
+
+    table_name, column_name = suggestion
+    return Index(
+        index_name(suggestion), metadata.tables[table_name].c[column_name]
+    )
+
+
+def index_source(suggestion, base=None):
+    """Python source declaring an index for ``suggestion``, in terms of
+    the mapped class of ``base`` when there is one."""
+
+    table_name, column_name = suggestion
+    if base is not None:
+        for mapper in base.registry.mappers:
+            table = mapper.local_table
+            if table.name == table_name:
+                return "Index(%r, %s.%s)" % (
+                    index_name(suggestion),
+                    mapper.class_.__name__,
+                    table.c[column_name].key,
+                )
+    return "Index(%r, %s.c.%s)" % (
+        index_name(suggestion),
+        table_name,
+        column_name,
+    )
+
+
+def _workload(conn):
+    arguments = {
+        "users_by_name": [(["user1", "user500", "user999"], 1)],
+        "user_emails": [("user%d" % i,) for i in (1, 500, 999)],
+        "multiple_emails": [(1,)],
+    }
+    for query, forms in queries.items():
+        for args in arguments[query]:
+            stmt, params = forms["plain"](*args)
+            conn.execute(stmt, params).all()
+
+
+def _latency(conn, shape, repeat):
+    timings = []
+    for i in range(repeat):
+        now = time.perf_counter()
+        conn.exec_driver_sql(shape.sql, shape.parameters).fetchall()
+        timings.append(time.perf_counter() - now)
+    return _util.percentile(timings, 50) * 1000
+
+
+def _summary(sql):
+    return " ".join(sql.split())[:60]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Suggest indexes for the select slide queries."
+    )
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--addresses-per-user", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    options = parser.parse_args(argv)
+
+    engine = create_engine("sqlite://")
+    print(
+        "Loading %d users, %d addresses each..."
+        % (options.users, options.addresses_per_user)
+    )
+    populate(engine, options.users, options.addresses_per_user)
+
+    recorder = WorkloadRecorder(engine)
+    with engine.connect() as conn:
+        with recorder:
+            _workload(conn)
+
+        shapes = analyze(conn, recorder, Base.metadata)
+        for shape in shapes:
+            print("\n%s" % shape.sql.strip())
+            for detail in shape.plan:
+                print("    %s" % detail)
+            if shape.full_scans:
+                print("  full scan: %s" % ", ".join(shape.full_scans))
+            if shape.temp_btrees:
+                print("  temp b-tree: %s" % ", ".join(shape.temp_btrees))
+
+        suggestions = suggest_indexes(shapes)
+        print("\nSuggested indexes:")
+        for suggestion in suggestions:
+            print("    %s" % index_source(suggestion, Base))
+        if not suggestions:
+            print("    (none)")
+
+        # build the indexes against a copy of the tables, so the
+        # application's MetaData isn't changed
+        scratch = MetaData()
+        for table in Base.metadata.sorted_tables:
+            table.to_metadata(scratch)
+
+        before = [_latency(conn, shape, options.repeat) for shape in shapes]
+        for suggestion in suggestions:
+            make_index(suggestion, scratch).create(conn)
+        after = [_latency(conn, shape, options.repeat) for shape in shapes]
+        analyze(conn, recorder, Base.metadata)
+        flagged_after = [shape.flagged for shape in shapes]
+        conn.rollback()
+
+    print()
+    _util.print_table(
+        ["statement", "ms before", "ms after", "speedup", "still flagged"],
+        [
+            [
+                _summary(shape.sql),
+                before_ms,
+                after_ms,
+                before_ms / after_ms if after_ms else 0.0,
+                "yes" if flagged else "",
+            ]
+            for shape, before_ms, after_ms, flagged in zip(
+                shapes, before, after, flagged_after
+            )
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
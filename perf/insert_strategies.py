@@ -0,0 +1,165 @@
+"""Compare ORM and Core INSERT strategies.
+
+``05_orm.py`` persists users with ``session.add()`` / ``add_all()`` and
+a flush, and with ORM bulk INSERT, ``session.execute(insert(User),
+[...])``; ``03_inserts.py`` uses Core, ``conn.execute(insert(User),
+[...])``.  This suite runs each of those, along with
+``Session.bulk_save_objects()`` and RETURNING variants, at several row
+counts::
+
+    python -m perf.insert_strategies --rows 10000 100000 1000000
+
+Each run happens in a fresh process against a new memory database, and
+reports elapsed time, the number of statements emitted and the peak
+resident memory of the process beyond what it started with.  Time
+includes building the objects or dictionaries to insert, since that is
+part of what each API costs.
+
+"""
+
+import argparse
+import concurrent.futures
+
+from sqlalchemy import create_engine
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from . import _util
+from .models import Base
+from .models import User
+from .models import user_rows
+
+
+def orm_add_all(engine, count):
+    with Session(engine) as session:
+        session.add_all(
+            User(params["name"], params["fullname"])
+            for params in user_rows(count)
+        )
+        session.commit()
+
+
+def orm_add_all_chunked(engine, count, chunk_size=10000):
+    # flush and expunge as we go, so the identity map stays small
+    with Session(engine) as session:
+        for i, params in enumerate(user_rows(count), 1):
+            session.add(User(params["name"], params["fullname"]))
+            if not i % chunk_size:
+                session.flush()
+                session.expunge_all()
+        session.commit()
+
+
+def orm_bulk_save_objects(engine, count):
+    with Session(engine) as session:
+        session.bulk_save_objects(
+            [
+                User(params["name"], params["fullname"])
+                for params in user_rows(count)
+            ]
+        )
+        session.commit()
+
+
+def orm_bulk_insert(engine, count):
+    with Session(engine) as session:
+        session.execute(insert(User), list(user_rows(count)))
+        session.commit()
+
+
+def orm_bulk_insert_returning_ids(engine, count):
+    with Session(engine) as session:
+        session.scalars(
+            insert(User).returning(User.id), list(user_rows(count))
+        ).all()
+        session.commit()
+
+
+def orm_bulk_insert_returning_objects(engine, count):
+    with Session(engine) as session:
+        session.scalars(
+            insert(User).returning(User), list(user_rows(count))
+        ).all()
+        session.commit()
+
+
+def core_insert(engine, count):
+    with engine.begin() as conn:
+        conn.execute(insert(User), list(user_rows(count)))
+
+
+def core_insert_returning(engine, count):
+    with engine.begin() as conn:
+        conn.execute(
+            insert(User).returning(User.id), list(user_rows(count))
+        ).all()
+
+
+strategies = {
+    "orm_add_all": orm_add_all,
+    "orm_add_all_chunked": orm_add_all_chunked,
+    "orm_bulk_save_objects": orm_bulk_save_objects,
+    "orm_bulk_insert": orm_bulk_insert,
+    "orm_bulk_insert_returning_ids": orm_bulk_insert_returning_ids,
+    "orm_bulk_insert_returning_objects": orm_bulk_insert_returning_objects,
+    "core_insert": core_insert,
+    "core_insert_returning": core_insert_returning,
+}
+
+
+def run_strategy(name, count):
+    """Run in a fresh process; returns (seconds, statements, memory)."""
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+
+    start_rss = _util.rss()
+    with _util.measure(engine) as m:
+        strategies[name](engine, count)
+
+    peak = _util.peak_rss()
+    memory = peak - start_rss if None not in (peak, start_rss) else None
+    return m.elapsed, m.statements, memory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare ORM and Core INSERT strategies."
+    )
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument(
+        "--strategies",
+        nargs="+",
+        choices=list(strategies),
+        default=list(strategies),
+    )
+    options = parser.parse_args(argv)
+
+    rows = []
+    for count in options.rows:
+        for name in options.strategies:
+            with concurrent.futures.ProcessPoolExecutor(1) as executor:
+                elapsed, statements, memory = executor.submit(
+                    run_strategy, name, count
+                ).result()
+            rows.append(
+                [
+                    count,
+                    name,
+                    elapsed,
+                    count / elapsed,
+                    statements,
+                    _util.format_bytes(memory),
+                ]
+            )
+
+    _util.print_table(
+        ["rows", "strategy", "seconds", "rows/sec", "statements", "peak mem"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Tune ``insertmanyvalues_page_size`` for bulk INSERT..RETURNING.
+
+The ``insert(User).returning(User.id)`` executemany in the
+``04_selects.py`` setup slide is run by SQLAlchemy's "insertmanyvalues"
+feature, which renders batches of rows into single multi-VALUES INSERT
+statements; the number of rows per statement is set with
+``create_engine(..., insertmanyvalues_page_size=N)`` and defaults to
+1000.
+
+This harness sweeps page sizes and the number of rows passed to each
+``execute()`` call, with and without RETURNING, against memory and file
+SQLite, then recommends a page size::
+
+    python -m perf.insertmanyvalues --rows 1000000
+
+Without RETURNING, the SQLite dialect uses the DBAPI's
+``cursor.executemany()`` rather than insertmanyvalues, so the page size
+has no effect there and those runs are done once per batch size.
+
+"""
+
+import argparse
+import itertools
+
+from sqlalchemy import create_engine
+from sqlalchemy import insert
+
+from . import _util
+from .models import Base
+from .models import chunks
+from .models import User
+from .models import user_rows
+
+
+def run_one(url, rows, batch_size, returning, page_size=None):
+    kw = {}
+    if page_size is not None:
+        kw["insertmanyvalues_page_size"] = page_size
+    engine = create_engine(url, **kw)
+    Base.metadata.create_all(engine)
+
+    stmt = insert(User)
+    if returning:
+        stmt = stmt.returning(User.id)
+
+    with engine.begin() as conn:
+        with _util.measure(engine) as m:
+            for chunk in chunks(user_rows(rows), batch_size):
+                result = conn.execute(stmt, chunk)
+                if returning:
+                    result.all()
+    engine.dispose()
+    return m
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Sweep insertmanyvalues_page_size for bulk INSERTs."
+    )
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument(
+        "--page-sizes",
+        type=int,
+        nargs="+",
+        default=[100, 250, 500, 1000, 2000, 5000],
+    )
+    parser.add_argument(
+        "--batch-sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="rows passed to each execute() call",
+    )
+    parser.add_argument(
+        "--databases",
+        nargs="+",
+        choices=["memory", "file"],
+        default=["memory", "file"],
+    )
+    options = parser.parse_args(argv)
+
+    rows = []
+    # (database, page size) -> rows/sec of each RETURNING run
+    returning_rates = {}
+
+    for database, returning in itertools.product(
+        options.databases, (False, True)
+    ):
+        page_sizes = options.page_sizes if returning else [None]
+        for page_size, batch_size in itertools.product(
+            page_sizes, options.batch_sizes
+        ):
+            with _util.database_url(database) as url:
+                m = run_one(
+                    url, options.rows, batch_size, returning, page_size
+                )
+            rate = options.rows / m.elapsed
+            if returning:
+                returning_rates.setdefault(
+                    (database, page_size), []
+                ).append(rate)
+            rows.append(
+                [
+                    database,
+                    "yes" if returning else "no",
+                    page_size if page_size is not None else "n/a",
+                    batch_size,
+                    m.elapsed,
+                    rate,
+                    m.statements,
+                ]
+            )
+
+    _util.print_table(
+        [
+            "database",
+            "RETURNING",
+            "page size",
+            "batch size",
+            "seconds",
+            "rows/sec",
+            "statements",
+        ],
+        rows,
+    )
+
+    print()
+    for database in options.databases:
+        rates = [
+            (_util.mean(r), page_size)
+            for (db, page_size), r in returning_rates.items()
+            if db == database
+        ]
+        if not rates:
+            continue
+        best_rate, best_page_size = max(rates)
+        print(
+            "%s: recommended insertmanyvalues_page_size=%d "
+            "(%.0f rows/sec averaged over batch sizes)"
+            % (database, best_page_size, best_rate)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""Construction time and memory footprint of ``User`` / ``Address``
+instances.
+
+``User("spongebob", "Spongebob Squarepants")`` in ``02_metadata.py`` and
+``05_orm.py`` builds a ``MappedAsDataclass`` instance that also carries
+ORM instrumentation state.  For batch jobs that only read, a compact
+``__slots__`` class is much smaller; :class:`SlotsBundle` lets the ORM
+load directly into one::
+
+    bundle = SlotsBundle(UserRecord, User.id, User.name, User.fullname,
+                         User.created_at)
+    for (record,) in session.execute(select(bundle)):
+        ...
+
+The benchmark compares plain declarative, ``MappedAsDataclass``,
+``__slots__`` and tuple representations, both constructed directly and
+loaded from the database::
+
+    python -m perf.instance_footprint --count 1000000
+
+Bytes per instance is traced memory divided by the number of instances,
+so it includes everything the instance keeps alive, such as ORM
+``InstanceState`` and the instance ``__dict__``, plus one list slot.
+
+"""
+
+import argparse
+import collections
+import gc
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy import ForeignKey
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.orm import Bundle
+from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import mapped_column
+from sqlalchemy.orm import Session
+
+from . import _util
+from . import models
+
+
+class PlainBase(DeclarativeBase):
+    pass
+
+
+class PlainUser(PlainBase):
+    __tablename__ = "user_account"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str]
+    fullname: Mapped[Optional[str]]
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+
+class PlainAddress(PlainBase):
+    __tablename__ = "address"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    email_address: Mapped[str]
+    user_id: Mapped[int] = mapped_column(ForeignKey("user_account.id"))
+
+
+class UserRecord(object):
+    """Read-only, compact ``User``."""
+
+    __slots__ = ("id", "name", "fullname", "created_at")
+
+    def __init__(self, id, name, fullname, created_at):
+        self.id = id
+        self.name = name
+        self.fullname = fullname
+        self.created_at = created_at
+
+    def __repr__(self):
+        return "UserRecord(id=%r, name=%r)" % (self.id, self.name)
+
+
+class AddressRecord(object):
+    """Read-only, compact ``Address``."""
+
+    __slots__ = ("id", "email_address", "user_id")
+
+    def __init__(self, id, email_address, user_id):
+        self.id = id
+        self.email_address = email_address
+        self.user_id = user_id
+
+    def __repr__(self):
+        return "AddressRecord(id=%r, email_address=%r)" % (
+            self.id,
+            self.email_address,
+        )
+
+
+UserTuple = collections.namedtuple(
+    "UserTuple", ["id", "name", "fullname", "created_at"]
+)
+AddressTuple = collections.namedtuple(
+    "AddressTuple", ["id", "email_address", "user_id"]
+)
+
+
+class SlotsBundle(Bundle):
+    """A ``Bundle`` that loads each row into ``cls``, which is called
+    with the bundle's columns positionally."""
+
+    def __init__(self, cls, *exprs, **kw):
+        Bundle.__init__(self, cls.__name__, *exprs, **kw)
+        self.cls = cls
+
+    def create_row_processor(self, query, procs, labels):
+        cls = self.cls
+
+        def proc(row):
+            return cls(*[p(row) for p in procs])
+
+        return proc
+
+
+_created_at = datetime(2023, 3, 1)
+
+
+def _construct(kind, entity, count):
+    if entity == "user":
+        if kind == "plain":
+            return [
+                PlainUser(name="user%d" % i, fullname="User %d" % i)
+                for i in range(count)
+            ]
+        elif kind == "dataclass":
+            return [
+                models.User("user%d" % i, "User %d" % i) for i in range(count)
+            ]
+        elif kind == "slots":
+            return [
+                UserRecord(i, "user%d" % i, "User %d" % i, _created_at)
+                for i in range(count)
+            ]
+        else:
+            return [
+                UserTuple(i, "user%d" % i, "User %d" % i, _created_at)
+                for i in range(count)
+            ]
+    else:
+        if kind == "plain":
+            return [
+                PlainAddress(email_address="u%d@example.com" % i, user_id=i)
+                for i in range(count)
+            ]
+        elif kind == "dataclass":
+            return [
+                models.Address("u%d@example.com" % i, i) for i in range(count)
+            ]
+        elif kind == "slots":
+            return [
+                AddressRecord(i, "u%d@example.com" % i, i)
+                for i in range(count)
+            ]
+        else:
+            return [
+                AddressTuple(i, "u%d@example.com" % i, i)
+                for i in range(count)
+            ]
+
+
+def _load(session, kind, entity):
+    if entity == "user":
+        if kind == "plain":
+            return session.scalars(select(PlainUser)).all()
+        elif kind == "dataclass":
+            return session.scalars(select(models.User)).all()
+        elif kind == "slots":
+            bundle = SlotsBundle(
+                UserRecord,
+                models.User.id,
+                models.User.name,
+                models.User.fullname,
+                models.User.created_at,
+            )
+            return session.scalars(select(bundle)).all()
+        else:
+            return [
+                UserTuple(*row)
+                for row in session.execute(
+                    select(
+                        models.User.id,
+                        models.User.name,
+                        models.User.fullname,
+                        models.User.created_at,
+                    )
+                )
+            ]
+    else:
+        if kind == "plain":
+            return session.scalars(select(PlainAddress)).all()
+        elif kind == "dataclass":
+            return session.scalars(select(models.Address)).all()
+        elif kind == "slots":
+            bundle = SlotsBundle(
+                AddressRecord,
+                models.Address.id,
+                models.Address.email_address,
+                models.Address.user_id,
+            )
+            return session.scalars(select(bundle)).all()
+        else:
+            return [
+                AddressTuple(*row)
+                for row in session.execute(
+                    select(
+                        models.Address.id,
+                        models.Address.email_address,
+                        models.Address.user_id,
+                    )
+                )
+            ]
+
+
+def _timed(fn, *arg):
+    gc.collect()
+    start = time.perf_counter()
+    result = fn(*arg)
+    elapsed = time.perf_counter() - start
+    del result
+    gc.collect()
+    return elapsed
+
+
+def _bytes_per_instance(count, fn, *arg):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = fn(*arg)
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    gc.collect()
+    return (after - before) / float(count)
+
+
+kinds = ["plain", "dataclass", "slots", "tuple"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare construction time and memory per instance."
+    )
+    parser.add_argument("--count", type=int, default=1000000)
+    parser.add_argument(
+        "--kinds", nargs="+", choices=kinds, default=kinds
+    )
+    options = parser.parse_args(argv)
+    count = options.count
+
+    engine = create_engine("sqlite://")
+    print("Loading %d users and addresses..." % count)
+    models.populate(engine, count, addresses_per_user=1)
+
+    rows = []
+    for entity in ("user", "address"):
+        for kind in options.kinds:
+            construct = _timed(_construct, kind, entity, count)
+            construct_bytes = _bytes_per_instance(
+                count, _construct, kind, entity, count
+            )
+
+            with Session(engine) as session:
+                load = _timed(_load, session, kind, entity)
+            with Session(engine) as session:
+                load_bytes = _bytes_per_instance(
+                    count, _load, session, kind, entity
+                )
+
+            rows.append(
+                [
+                    entity,
+                    kind,
+                    count / construct,
+                    "%d" % construct_bytes,
+                    count / load,
+                    "%d" % load_bytes,
+                ]
+            )
+
+    _util.print_table(
+        [
+            "entity",
+            "representation",
+            "constructed/sec",
+            "bytes each",
+            "loaded/sec",
+            "bytes each (loaded)",
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+"""Keyset ("seek") pagination for ordered selects.
+
+``04_selects.py`` orders with ``stmt.order_by(User.id)``.  Paging
+through such a statement with LIMIT / OFFSET makes the database read
+and discard every row before the page, so deep pages get linearly
+slower.  :class:`Keyset` instead filters on the ordering key of the row
+at the edge of the previous page, which an index on the key can seek to
+directly::
+
+    keyset = Keyset(select(User), User.created_at, User.id, page_size=50)
+
+    stmt = keyset.statement(token)
+    page = keyset.page(session.scalars(stmt).all(), token)
+    page.rows, page.next, page.previous
+
+``token`` is None for the first page, and otherwise a ``page.next`` or
+``page.previous`` token from an earlier page; tokens are opaque,
+URL-safe strings.  The same works with ``connection.execute(stmt)``
+rows, as long as the ordering columns are selected under their own
+names, or are attributes of the selected entity.
+
+The ordering must be unique, so include the primary key last, and all
+columns must sort in the same direction, since the criteria is a row
+value comparison such as ``(created_at, id) > (?, ?)``.
+
+SQLite stores datetimes as strings, and ``func.now()`` stores them
+without the fractional seconds the ``DateTime`` type binds, so the
+stored value sorts before a bound parameter for the same instant.  On
+SQLite, ``DateTime`` columns are therefore ordered and compared as
+``julianday(created_at)``, which doesn't depend on the stored format
+and is precise to the millisecond, with ties broken by the columns that
+follow.  An index for such an ordering is on the same expressions::
+
+    CREATE INDEX ix_user_account_created_at_id
+    ON user_account (julianday(created_at), id)
+
+SQLite seeks such an index on the first key only, and reads through
+rows that tie with the page edge on it, so a leading column with many
+equal values, such as timestamps from one bulk insert, pages slowly.
+
+The benchmark compares LIMIT / OFFSET with keyset pages at increasing
+depth, through both Core and the ORM::
+
+    python -m perf.keyset --users 1000000 --pages 1 100 1000 10000
+
+"""
+
+import argparse
+import base64
+import datetime
+import json
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy import insert
+from sqlalchemy import literal
+from sqlalchemy import select
+from sqlalchemy import tuple_
+from sqlalchemy import types as sqltypes
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import UnaryExpression
+from sqlalchemy.sql.functions import FunctionElement
+
+from . import _util
+from .models import Base
+from .models import populate
+from .models import User
+
+
+class _datetime_key(FunctionElement):
+    """A datetime expression as a value that orders the same whatever
+    format it's stored in."""
+
+    inherit_cache = True
+
+    def __init__(self, expr):
+        FunctionElement.__init__(self, expr)
+        self.type = expr.type
+
+
+@compiles(_datetime_key)
+def _compile_datetime_key(element, compiler, **kw):
+    return compiler.process(element.clauses, **kw)
+
+
+@compiles(_datetime_key, "sqlite")
+def _compile_datetime_key_sqlite(element, compiler, **kw):
+    return "julianday(%s)" % compiler.process(element.clauses, **kw)
+
+
+def _is_datetime(column):
+    affinity = getattr(column.type, "_type_affinity", None)
+    return affinity is not None and issubclass(affinity, sqltypes.DateTime)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {"dt": value.isoformat()}
+    elif isinstance(value, datetime.date):
+        return {"d": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.datetime.fromisoformat(value["dt"])
+        return datetime.date.fromisoformat(value["d"])
+    return value
+
+
+def encode_token(direction, values):
+    """Encode a direction, ``"n"`` or ``"p"``, and key values."""
+
+    data = json.dumps(
+        [direction, [_encode_value(value) for value in values]],
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def decode_token(token):
+    """Return ``(direction, values)`` from :func:`encode_token`."""
+
+    try:
+        direction, values = json.loads(
+            base64.urlsafe_b64decode(token.encode("ascii"))
+        )
+    except (ValueError, TypeError) as err:
+        raise ValueError("invalid page token: %s" % err)
+    if direction not in ("n", "p"):
+        raise ValueError("invalid page token direction %r" % (direction,))
+    return direction, [_decode_value(value) for value in values]
+
+
+class Page(object):
+    """Rows of one page, with tokens for its neighbours, or None where
+    there are no more rows in that direction."""
+
+    __slots__ = ("rows", "next", "previous")
+
+    def __init__(self, rows, next, previous):
+        self.rows = rows
+        self.next = next
+        self.previous = previous
+
+    def __repr__(self):
+        return "Page(%d rows, next=%r, previous=%r)" % (
+            len(self.rows),
+            self.next,
+            self.previous,
+        )
+
+
+class Keyset(object):
+    """Keyset pagination of ``stmt`` ordered by ``order_by``.
+
+    Any ORDER BY ``stmt`` already has is replaced by ``order_by``.
+
+    """
+
+    def __init__(self, stmt, *order_by, **kw):
+        self.page_size = kw.pop("page_size", 50)
+        if kw:
+            raise TypeError("unexpected arguments: %s" % ", ".join(kw))
+        if not order_by:
+            raise ValueError("at least one ordering column is required")
+
+        descending = set()
+        self.columns = []
+        for element in order_by:
+            if isinstance(element, UnaryExpression) and element.modifier in (
+                operators.desc_op,
+                operators.asc_op,
+            ):
+                descending.add(element.modifier is operators.desc_op)
+                element = element.element
+            else:
+                descending.add(False)
+            self.columns.append(element)
+        if len(descending) > 1:
+            raise ValueError(
+                "all ordering columns must sort in the same direction"
+            )
+        self.descending = descending.pop()
+        # pages, and the OFFSET pages they're checked against, order by
+        # the keys alone; an ORDER BY left on stmt would come first
+        self.stmt = stmt.order_by(None)
+        self._keys = [
+            _datetime_key(column) if _is_datetime(column) else column
+            for column in self.columns
+        ]
+
+    def _ordered(self, reverse):
+        descending = self.descending != reverse
+        return [key.desc() if descending else key.asc() for key in self._keys]
+
+    def _criteria(self, values, after):
+        bounds = [
+            _datetime_key(literal(value, column.type))
+            if _is_datetime(column)
+            else literal(value, column.type)
+            for column, value in zip(self.columns, values)
+        ]
+        if len(bounds) == 1:
+            key, bound = self._keys[0], bounds[0]
+            return [key > bound if after else key < bound]
+
+        key, bound = tuple_(*self._keys), tuple_(*bounds)
+        # the redundant comparison on the first key lets SQLite seek
+        # an index on expressions such as julianday(), which it doesn't
+        # do for the row value comparison alone
+        first, first_bound = self._keys[0], bounds[0]
+        if after:
+            return [first >= first_bound, key > bound]
+        else:
+            return [first <= first_bound, key < bound]
+
+    def statement(self, token=None):
+        """The statement for the page ``token`` refers to; it selects
+        one row more than ``page_size``, so :meth:`page` can tell whether
+        another page follows."""
+
+        stmt = self.stmt
+        reverse = False
+        if token is not None:
+            direction, values = decode_token(token)
+            if len(values) != len(self.columns):
+                raise ValueError("page token doesn't match this ordering")
+            reverse = direction == "p"
+            stmt = stmt.where(
+                *self._criteria(values, self.descending == reverse)
+            )
+        return stmt.order_by(*self._ordered(reverse)).limit(
+            self.page_size + 1
+        )
+
+    def _values(self, row):
+        return [getattr(row, column.key) for column in self.columns]
+
+    def page(self, rows, token=None):
+        """Build the :class:`Page` from the rows :meth:`statement`
+        returned for ``token``."""
+
+        rows = list(rows)
+        more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        direction = decode_token(token)[0] if token is not None else None
+
+        if direction == "p":
+            rows.reverse()
+            has_next, has_previous = True, more
+        else:
+            has_next, has_previous = more, direction == "n"
+
+        if not rows:
+            return Page(rows, None, None)
+        return Page(
+            rows,
+            encode_token("n", self._values(rows[-1])) if has_next else None,
+            encode_token("p", self._values(rows[0]))
+            if has_previous
+            else None,
+        )
+
+
+def _latency(fn, repeat):
+    timings = []
+    for i in range(repeat):
+        now = time.perf_counter()
+        rows = fn()
+        timings.append(time.perf_counter() - now)
+    return _util.percentile(timings, 50), rows
+
+
+def _check(engine, keyset, page_size, pages=5):
+    """Walk forward and back, comparing with OFFSET pages."""
+
+    with Session(engine) as session:
+        ordered = keyset.stmt.order_by(*keyset._ordered(False))
+        expected = [
+            session.scalars(
+                ordered.offset(page_size * n).limit(page_size)
+            ).all()
+            for n in range(pages)
+        ]
+        token = None
+        forward = []
+        for n in range(pages):
+            page = keyset.page(
+                session.scalars(keyset.statement(token)).all(), token
+            )
+            forward.append(page.rows)
+            token = page.next
+        backward = []
+        token = page.previous
+        for n in range(pages):
+            if token is None:
+                break
+            page = keyset.page(
+                session.scalars(keyset.statement(token)).all(), token
+            )
+            backward.insert(0, page.rows)
+            token = page.previous
+        return forward == expected and backward == expected[:-1]
+
+
+def _check_stored_formats(page_size=3):
+    """Check (created_at, id) pages over rows whose created_at values
+    are stored both by the ``func.now()`` server default and as bound
+    datetimes, with and without microseconds, within the same second."""
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(User), [{"name": "now%d" % i} for i in range(5)]
+        )
+        now = conn.scalar(select(User.created_at).where(User.id == 1))
+        conn.execute(
+            insert(User),
+            [
+                {
+                    "name": "bound%d" % i,
+                    "created_at": now.replace(microsecond=i % 2 * 500),
+                }
+                for i in range(5)
+            ],
+        )
+    keyset = Keyset(
+        select(User), User.created_at, User.id, page_size=page_size
+    )
+    try:
+        return _check(engine, keyset, page_size, pages=4)
+    finally:
+        engine.dispose()
+
+
+def _check_ordered_statement(page_size=3):
+    """Check pages, in both directions, of a statement that's already
+    ordered by something other than the keys."""
+
+    engine = create_engine("sqlite://")
+    populate(engine, 20)
+    keyset = Keyset(
+        select(User).order_by(User.name.desc()), User.id, page_size=page_size
+    )
+    try:
+        return _check(engine, keyset, page_size)
+    finally:
+        engine.dispose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare keyset pagination with LIMIT / OFFSET."
+    )
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument(
+        "--pages", type=int, nargs="+", default=[1, 100, 1000, 10000]
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    options = parser.parse_args(argv)
+    size = options.page_size
+
+    if not _check_stored_formats():
+        print("keyset pages don't match OFFSET pages for mixed formats")
+    if not _check_ordered_statement():
+        print("keyset pages don't match OFFSET pages for an ordered select")
+
+    engine = create_engine("sqlite://")
+    print("Loading %d users..." % options.users)
+    populate(engine, options.users)
+    with engine.begin() as conn:
+        # rows from populate() share the few seconds they were inserted
+        # in; spread them over a day, in the format func.now() stores
+        conn.exec_driver_sql(
+            "UPDATE user_account SET created_at = "
+            "datetime(created_at, '-' || (id * 7919 % 86400) || ' seconds')"
+        )
+        # for the (created_at, id) ordering, which Keyset compares
+        # with julianday()
+        conn.exec_driver_sql(
+            "CREATE INDEX ix_user_account_created_at_id "
+            "ON user_account (julianday(created_at), id)"
+        )
+
+    orderings = [
+        ("id", (User.id,)),
+        ("created_at, id", (User.created_at, User.id)),
+    ]
+    rows = []
+    for label, order_by in orderings:
+        core = Keyset(
+            select(User.id, User.name, User.created_at),
+            *order_by,
+            page_size=size
+        )
+        orm = Keyset(select(User), *order_by, page_size=size)
+        if not _check(engine, orm, size):
+            print("%s: keyset pages don't match OFFSET pages" % label)
+
+        with engine.connect() as conn, Session(engine) as session:
+            for number in options.pages:
+                offset = (number - 1) * size
+                # the token a client would hold for this page: the key
+                # of the last row of the page before
+                token = None
+                if offset:
+                    edge = conn.execute(
+                        core.stmt.order_by(*core._ordered(False))
+                        .offset(offset - 1)
+                        .limit(1)
+                    ).one()
+                    token = encode_token("n", core._values(edge))
+
+                for api, keyset, run in [
+                    (
+                        "Connection.execute",
+                        core,
+                        lambda stmt: conn.execute(stmt).all(),
+                    ),
+                    (
+                        "Session.scalars",
+                        orm,
+                        lambda stmt: session.scalars(stmt).all(),
+                    ),
+                ]:
+                    offset_stmt = (
+                        keyset.stmt.order_by(*keyset._ordered(False))
+                        .offset(offset)
+                        .limit(size)
+                    )
+                    offset_time, expected = _latency(
+                        lambda: run(offset_stmt), options.repeat
+                    )
+                    keyset_stmt = keyset.statement(token)
+                    keyset_time, result = _latency(
+                        lambda: keyset.page(run(keyset_stmt), token).rows,
+                        options.repeat,
+                    )
+                    session.expunge_all()
+                    rows.append(
+                        [
+                            label,
+                            api,
+                            number,
+                            offset_time * 1000,
+                            keyset_time * 1000,
+                            offset_time / keyset_time,
+                            "" if result == expected else "MISMATCH",
+                        ]
+                    )
+
+    print("%d rows per page" % size)
+    _util.print_table(
+        [
+            "order by",
+            "api",
+            "page",
+            "offset ms",
+            "keyset ms",
+            "speedup",
+            "check",
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
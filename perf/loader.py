@@ -0,0 +1,311 @@
+"""Stream ``User`` / ``Address`` rows from CSV or JSONL files.
+
+``03_inserts.py`` passes literal lists of dictionaries to
+``conn.execute(insert(User), [...])``.  Loading a large file the same way
+means reading the whole file into a list first.  The functions here
+instead stream records through generators and insert them in
+bounded-size chunks, using the same ``insert()`` constructs, so memory
+use is independent of the size of the file:
+
+* :func:`read_records` yields dictionaries from a ``.csv`` or ``.jsonl``
+  file
+* :func:`load_users` converts and inserts user records
+* :func:`load_addresses` resolves each address's ``user_name`` to
+  ``Address.user_id`` a chunk at a time and inserts the addresses
+
+Users are identified in the address file by name.  If names repeat, the
+lowest id is used; addresses whose user can't be found are skipped and
+counted.  The models declare no index on ``user_account.name``, so each
+chunk's lookup scans the table; adding one makes that stage far faster
+on large tables.
+
+The benchmark generates files, loads them, and reports throughput for
+each stage along with resident memory growth, compared with reading the
+file into a list first::
+
+    python -m perf.loader --users 1000000 --format csv
+
+"""
+
+import argparse
+import csv
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import select
+
+from . import _util
+from .models import Address
+from .models import Base
+from .models import chunks
+from .models import User
+
+
+class StageStats(object):
+    """Accumulates rows and seconds for each named stage."""
+
+    def __init__(self):
+        self.rows = {}
+        self.seconds = {}
+
+    def add(self, stage, rows, seconds):
+        self.rows[stage] = self.rows.get(stage, 0) + rows
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def timed(self, stage, iterable):
+        """Wrap ``iterable``, charging the time spent producing each item
+        to ``stage``."""
+
+        iterator = iter(iterable)
+        while True:
+            now = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, 0, time.perf_counter() - now)
+                return
+            self.add(stage, 1, time.perf_counter() - now)
+            yield item
+
+
+def read_records(path):
+    """Yield a dictionary for each record in a ``.csv`` or ``.jsonl``
+    file."""
+
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as file_:
+            for line in file_:
+                if line.strip():
+                    yield json.loads(line)
+    elif path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as file_:
+            yield from csv.DictReader(file_)
+    else:
+        raise ValueError("expected a .csv or .jsonl file: %s" % path)
+
+
+def _optional(value):
+    # CSV has no NULL; treat empty strings as missing
+    return value if value not in ("", None) else None
+
+
+def convert_user(record):
+    """Convert a user record to parameters for ``insert(User)``.
+
+    ``created_at`` is parsed from ISO format; when it's missing the
+    server default applies.
+
+    """
+    params = {
+        "name": record["name"],
+        "fullname": _optional(record.get("fullname")),
+    }
+    created_at = _optional(record.get("created_at"))
+    if created_at is not None:
+        params["created_at"] = datetime.fromisoformat(created_at)
+    return params
+
+
+def load_users(connection, records, chunk_size=10000, stats=None):
+    """Insert user ``records`` in chunks; returns the number inserted."""
+
+    stats = stats if stats is not None else StageStats()
+    params = (convert_user(record) for record in records)
+
+    total = 0
+    for chunk in chunks(stats.timed("read users", params), chunk_size):
+        # rows without created_at go in their own statement, so the
+        # server default applies to them
+        with_date = [p for p in chunk if "created_at" in p]
+        without_date = [p for p in chunk if "created_at" not in p]
+
+        now = time.perf_counter()
+        for group in (with_date, without_date):
+            if group:
+                connection.execute(insert(User), group)
+        stats.add("insert users", len(chunk), time.perf_counter() - now)
+        total += len(chunk)
+    return total
+
+
+def load_addresses(connection, records, chunk_size=10000, stats=None):
+    """Insert address ``records``, which refer to users by
+    ``user_name``, in chunks.
+
+    Returns ``(inserted, skipped)``.
+
+    """
+    stats = stats if stats is not None else StageStats()
+
+    inserted = skipped = 0
+    for chunk in chunks(stats.timed("read addresses", records), chunk_size):
+        now = time.perf_counter()
+        names = {record["user_name"] for record in chunk}
+        ids = dict(
+            connection.execute(
+                select(User.name, func.min(User.id))
+                .where(User.name.in_(names))
+                .group_by(User.name)
+            ).all()
+        )
+        stats.add("resolve user_id", len(chunk), time.perf_counter() - now)
+
+        params = []
+        for record in chunk:
+            user_id = ids.get(record["user_name"])
+            if user_id is None:
+                skipped += 1
+            else:
+                params.append(
+                    {
+                        "user_id": user_id,
+                        "email_address": record["email_address"],
+                    }
+                )
+
+        now = time.perf_counter()
+        if params:
+            connection.execute(insert(Address), params)
+        stats.add("insert addresses", len(params), time.perf_counter() - now)
+        inserted += len(params)
+    return inserted, skipped
+
+
+def load_files(
+    connection, users_path, addresses_path, chunk_size=10000, stats=None
+):
+    """Load a users file and then an addresses file."""
+
+    stats = stats if stats is not None else StageStats()
+    load_users(connection, read_records(users_path), chunk_size, stats)
+    return load_addresses(
+        connection, read_records(addresses_path), chunk_size, stats
+    )
+
+
+def write_sample_files(directory, num_users, per_user, format_):
+    """Write users and addresses files for the benchmark; returns their
+    paths."""
+
+    users_path = os.path.join(directory, "users.%s" % format_)
+    addresses_path = os.path.join(directory, "addresses.%s" % format_)
+
+    def users():
+        for i in range(num_users):
+            yield {
+                "name": "user%d" % i,
+                "fullname": "User Number %d" % i,
+                "created_at": "2023-03-%02dT12:00:00" % (i % 28 + 1),
+            }
+
+    def addresses():
+        for i in range(num_users):
+            for j in range(per_user):
+                yield {
+                    "user_name": "user%d" % i,
+                    "email_address": "user%d.%d@example.com" % (i, j),
+                }
+
+    for path, records, fields in [
+        (users_path, users(), ["name", "fullname", "created_at"]),
+        (addresses_path, addresses(), ["user_name", "email_address"]),
+    ]:
+        with open(path, "w", newline="", encoding="utf-8") as file_:
+            if format_ == "csv":
+                writer = csv.DictWriter(file_, fields)
+                writer.writeheader()
+                writer.writerows(records)
+            else:
+                for record in records:
+                    file_.write(json.dumps(record))
+                    file_.write("\n")
+    return users_path, addresses_path
+
+
+def _run(url, users_path, addresses_path, chunk_size, streaming):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    stats = StageStats()
+
+    baseline = peak = _util.rss()
+    now = time.perf_counter()
+    with engine.begin() as conn:
+        if streaming:
+            load_files(conn, users_path, addresses_path, chunk_size, stats)
+        else:
+            # what the import job does today: read everything first
+            users = list(read_records(users_path))
+            addresses = list(read_records(addresses_path))
+            peak = _util.rss()
+            load_users(conn, users, chunk_size, stats)
+            load_addresses(conn, addresses, chunk_size, stats)
+            del users, addresses
+    elapsed = time.perf_counter() - now
+    engine.dispose()
+
+    current = _util.rss()
+    if None in (baseline, peak, current):
+        growth = None
+    else:
+        growth = max(peak, current) - baseline
+    return stats, elapsed, growth
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Stream users and addresses from CSV / JSONL files."
+    )
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--addresses-per-user", type=int, default=2)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument(
+        "--no-compare",
+        action="store_true",
+        help="don't run the read-everything-first comparison",
+    )
+    options = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print("Writing sample files...")
+        users_path, addresses_path = write_sample_files(
+            tmpdir, options.users, options.addresses_per_user, options.format
+        )
+
+        modes = [("streaming", True)]
+        if not options.no_compare:
+            modes.append(("read into list", False))
+
+        for label, streaming in modes:
+            url = "sqlite:///%s" % os.path.join(tmpdir, "%s.db" % streaming)
+            stats, elapsed, growth = _run(
+                url, users_path, addresses_path, options.chunk_size, streaming
+            )
+            print(
+                "\n%s: %.2f s total, resident memory growth %s"
+                % (label, elapsed, _util.format_bytes(growth))
+            )
+            _util.print_table(
+                ["stage", "rows", "seconds", "rows/sec"],
+                [
+                    [
+                        stage,
+                        stats.rows[stage],
+                        stats.seconds[stage],
+                        stats.rows[stage] / stats.seconds[stage]
+                        if stats.seconds[stage]
+                        else 0.0,
+                    ]
+                    for stage in stats.rows
+                ],
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""Profile mapper configuration for large declarative model graphs, and
+configure lazily.
+
+The ``Base(MappedAsDataclass, DeclarativeBase)`` models in
+``02_metadata.py`` and ``06_orm_relationships.py`` are cheap with a
+handful of classes, however with hundreds of them three costs become
+visible:
+
+* class creation, including generation of the dataclass ``__init__``
+  and other methods, paid at import time
+* ``configure_mappers()``, which resolves every ``relationship()``,
+  including ``back_populates``, paid the first time any mapper is used
+* both of the above, for every class in the registry, even if the
+  process only touches a few of them
+
+The last one is addressed with :func:`make_base`: mappers are
+configured a registry at a time, so giving each independent group of
+models its own registry, while still sharing one ``MetaData``, means
+that using a mapper only configures the mappers of its own group (and
+of the groups it has relationships to).
+
+The benchmark generates a model graph and reports time for each phase,
+then, from a separate profiled run, a per-module breakdown from
+``cProfile``::
+
+    python -m perf.mapper_config --classes 300 --groups 10
+
+"""
+
+import argparse
+import concurrent.futures
+import cProfile
+import os
+import pstats
+import tempfile
+import time
+
+from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import MappedAsDataclass
+
+from . import _util
+
+
+def make_base(metadata, dataclasses=True, name="Base"):
+    """Return a new declarative base with its own registry, using the
+    given shared ``metadata``."""
+
+    if dataclasses:
+        bases = (MappedAsDataclass, DeclarativeBase)
+    else:
+        bases = (DeclarativeBase,)
+    return type(name, bases, {"metadata": metadata})
+
+
+def generate_models_source(num_classes, num_groups, dataclasses=True):
+    """Return Python source for ``num_classes`` mapped classes in
+    ``num_groups`` independent groups.
+
+    Within a group, each class has a many-to-one ``parent`` to the class
+    before it and a one-to-many ``children`` to the class after it,
+    linked with ``back_populates``.  With ``num_groups=1`` a single base
+    and registry is used for all classes; otherwise each group gets its
+    own from :func:`make_base`.
+
+    """
+    lines = [
+        "from typing import List, Optional",
+        "from sqlalchemy import ForeignKey, MetaData",
+        "from sqlalchemy.orm import Mapped, mapped_column, relationship",
+        "from perf.mapper_config import make_base",
+        "",
+        "metadata = MetaData()",
+    ]
+    for group in range(num_groups):
+        lines.append(
+            "Base%d = make_base(metadata, dataclasses=%r, name='Base%d')"
+            % (group, dataclasses, group)
+        )
+    lines.append("")
+
+    per_group = -(-num_classes // num_groups)
+
+    def dc(text):
+        return text if dataclasses else ""
+
+    for i in range(num_classes):
+        group, index = divmod(i, per_group)
+        first = index == 0
+        last = index == per_group - 1 or i == num_classes - 1
+        lines.append("class Model%d(Base%d):" % (i, group))
+        lines.append("    __tablename__ = 'model_%d'" % i)
+        lines.append(
+            "    id: Mapped[int] = mapped_column(primary_key=True%s)"
+            % dc(", init=False")
+        )
+        lines.append("    name: Mapped[str]")
+        if not first:
+            lines.append(
+                "    parent_id: Mapped[Optional[int]] = mapped_column("
+                "ForeignKey('model_%d.id')%s)" % (i - 1, dc(", default=None"))
+            )
+            lines.append(
+                "    parent: Mapped[Optional['Model%d']] = relationship("
+                "back_populates='children'%s)" % (i - 1, dc(", default=None"))
+            )
+        if not last:
+            lines.append(
+                "    children: Mapped[List['Model%d']] = relationship("
+                "back_populates='parent'%s)"
+                % (i + 1, dc(", default_factory=list"))
+            )
+        lines.append("")
+    return "\n".join(lines)
+
+
+# how the profile is broken down; first match wins
+_categories = [
+    ("dataclass generation", ("/dataclasses.py",)),
+    ("relationship resolution", ("/orm/relationships.py",)),
+    ("mapper configuration", ("/orm/mapper.py",)),
+    (
+        "attribute instrumentation",
+        (
+            "/orm/attributes.py",
+            "/orm/instrumentation.py",
+            "/orm/strategies.py",
+        ),
+    ),
+    ("declarative scan", ("/orm/decl_base.py", "/orm/decl_api.py")),
+    ("annotations / typing", ("/typing.py", "/util/typing.py")),
+    ("Table / Column", ("/sql/schema.py",)),
+    ("other SQL constructs", ("/sqlalchemy/sql/",)),
+    ("events", ("/sqlalchemy/event/",)),
+    ("other ORM", ("/sqlalchemy/orm/",)),
+    ("other SQLAlchemy", ("/sqlalchemy/",)),
+]
+
+
+def _breakdown(profile):
+    stats = pstats.Stats(profile)
+    totals = {}
+    for (filename, lineno, funcname), row in stats.stats.items():
+        tottime = row[2]
+        filename = filename.replace(os.sep, "/")
+        for category, paths in _categories:
+            if any(path in filename for path in paths):
+                break
+        else:
+            category = "other"
+        totals[category] = totals.get(category, 0.0) + tottime
+    return totals
+
+
+def _exec_models(source_path, profile=None):
+    namespace = {"__name__": "generated_models"}
+    with open(source_path) as file_:
+        code = compile(file_.read(), source_path, "exec")
+    if profile is not None:
+        profile.enable()
+    try:
+        exec(code, namespace)
+    finally:
+        if profile is not None:
+            profile.disable()
+    return namespace
+
+
+def time_phases(source_path):
+    """Run in a fresh process: time class creation and
+    ``configure_mappers()`` for the whole graph, without profiling."""
+
+    from sqlalchemy.orm import configure_mappers
+
+    now = time.perf_counter()
+    _exec_models(source_path)
+    creation_time = time.perf_counter() - now
+
+    now = time.perf_counter()
+    configure_mappers()
+    configure_time = time.perf_counter() - now
+
+    return {"creation": creation_time, "configure": configure_time}
+
+
+def profile_phases(source_path):
+    """Run in a fresh process: profile class creation and
+    ``configure_mappers()`` for the whole graph, returning the profiled
+    time per area.
+
+    Profiling slows some areas far more than others, so the times
+    reported for each phase come from :func:`time_phases` instead.
+
+    """
+    from sqlalchemy.orm import configure_mappers
+
+    creation = cProfile.Profile()
+    _exec_models(source_path, creation)
+
+    configure = cProfile.Profile()
+    configure.enable()
+    configure_mappers()
+    configure.disable()
+
+    return {
+        "creation_breakdown": _breakdown(creation),
+        "configure_breakdown": _breakdown(configure),
+    }
+
+
+def first_use(source_path):
+    """Run in a fresh process: import the models, then use a single
+    mapper, which configures whatever that requires."""
+
+    from sqlalchemy import inspect
+
+    namespace = _exec_models(source_path)
+    model = namespace["Model0"]
+
+    now = time.perf_counter()
+    inspect(model).attrs
+    elapsed = time.perf_counter() - now
+
+    configured = sum(
+        1
+        for value in namespace.values()
+        if isinstance(value, type)
+        and hasattr(value, "__mapper__")
+        and value.__mapper__.configured
+    )
+    return {"first_use": elapsed, "configured": configured}
+
+
+def _in_subprocess(fn, *arg):
+    with concurrent.futures.ProcessPoolExecutor(1) as executor:
+        return executor.submit(fn, *arg).result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Profile mapper configuration on a generated graph."
+    )
+    parser.add_argument("--classes", type=int, default=300)
+    parser.add_argument(
+        "--groups",
+        type=int,
+        default=10,
+        help="number of independent groups for the lazy configuration "
+        "comparison",
+    )
+    options = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = {}
+        for label, groups, dataclasses in [
+            ("dataclass", 1, True),
+            ("plain", 1, False),
+            ("dataclass_grouped", options.groups, True),
+        ]:
+            paths[label] = path = os.path.join(tmpdir, "%s.py" % label)
+            with open(path, "w") as file_:
+                file_.write(
+                    generate_models_source(
+                        options.classes, groups, dataclasses
+                    )
+                )
+
+        dc = _in_subprocess(time_phases, paths["dataclass"])
+        plain = _in_subprocess(time_phases, paths["plain"])
+        dc_profile = _in_subprocess(profile_phases, paths["dataclass"])
+        single = _in_subprocess(first_use, paths["dataclass"])
+        grouped = _in_subprocess(first_use, paths["dataclass_grouped"])
+
+    print(
+        "%d classes, %d relationships\n"
+        % (options.classes, 2 * (options.classes - 1))
+    )
+    _util.print_table(
+        ["phase", "MappedAsDataclass s", "plain declarative s"],
+        [
+            ["class creation", dc["creation"], plain["creation"]],
+            ["configure_mappers()", dc["configure"], plain["configure"]],
+        ],
+    )
+    print(
+        "\ndataclass generation overhead at class creation: %.3f s\n"
+        % (dc["creation"] - plain["creation"])
+    )
+
+    categories = [c for c, _ in _categories] + ["other"]
+    _util.print_table(
+        ["profiled time by area", "creation s", "configure s"],
+        [
+            [
+                category,
+                dc_profile["creation_breakdown"].get(category, 0.0),
+                dc_profile["configure_breakdown"].get(category, 0.0),
+            ]
+            for category in categories
+        ],
+    )
+    print()
+    _util.print_table(
+        ["first use of one mapper", "seconds", "mappers configured"],
+        [
+            ["single registry", single["first_use"], single["configured"]],
+            [
+                "%d registries" % options.groups,
+                grouped["first_use"],
+                grouped["configured"],
+            ],
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Persist ``MetaData`` to a cache file to skip schema construction.
+
+``02_metadata.py`` builds its ``Table`` objects at import time, and
+``Base.metadata.create_all(conn)`` then checks for each table before
+emitting CREATE TABLE.  With hundreds of tables, both show up in
+startup and test fixture time.
+
+:func:`load_metadata` pickles the ``MetaData`` produced by a builder
+function to a file keyed by a hash of the model source, and unpickles it
+on later runs while the source is unchanged.  :func:`create_schema`
+skips the per-table existence checks when the database is known to
+be empty.
+
+The cached ``MetaData`` contains ``Table`` objects only; it serves
+``create_all()``, Core statements and reflection comparisons, while
+ORM mapped classes still need their declarations to be run.
+
+The benchmark generates a schema of 1000 tables and measures it
+before and after::
+
+    python -m perf.metadata_cache --tables 1000
+
+"""
+
+import argparse
+import hashlib
+import os
+import pickle
+import platform
+import tempfile
+
+import sqlalchemy
+from sqlalchemy import create_engine
+from sqlalchemy import inspect
+
+from . import _util
+
+
+def source_hash(paths):
+    """Hash the contents of ``paths`` together with the Python and
+    SQLAlchemy versions, either of which can change what's pickled."""
+
+    hasher = hashlib.sha256()
+    hasher.update(platform.python_version().encode())
+    hasher.update(sqlalchemy.__version__.encode())
+    for path in sorted(paths):
+        with open(path, "rb") as file_:
+            hasher.update(file_.read())
+    return hasher.hexdigest()
+
+
+def load_metadata(builder, source_paths, cache_dir):
+    """Return the ``MetaData`` from ``builder()``, cached on disk.
+
+    The cache file is named for the hash of ``source_paths``, which
+    should be the files that define the schema; a change to any of them
+    means a new cache file.
+
+    """
+    cache_path = os.path.join(
+        cache_dir, "metadata-%s.pickle" % source_hash(source_paths)
+    )
+    try:
+        with open(cache_path, "rb") as file_:
+            return pickle.load(file_)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    metadata = builder()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = "%s.%d.tmp" % (cache_path, os.getpid())
+    with open(tmp, "wb") as file_:
+        pickle.dump(metadata, file_, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, cache_path)
+    return metadata
+
+
+def create_schema(connection, metadata, known_empty=None):
+    """Run ``metadata.create_all()``, skipping the per-table existence
+    checks if the database has no tables.
+
+    If ``known_empty`` is None, a single query for the list of tables
+    determines it.
+
+    """
+    if known_empty is None:
+        known_empty = not inspect(connection).get_table_names()
+    metadata.create_all(connection, checkfirst=not known_empty)
+
+
+def generate_schema_source(num_tables):
+    """Return Python source for a module defining ``metadata`` with
+    ``num_tables`` tables, each referring to the one before it."""
+
+    lines = [
+        "from sqlalchemy import Column, DateTime, ForeignKey, Index",
+        "from sqlalchemy import Integer, MetaData, Numeric, String, Table",
+        "from sqlalchemy import func",
+        "",
+        "metadata = MetaData()",
+        "",
+    ]
+    for i in range(num_tables):
+        lines.append(
+            "Table(\n"
+            "    'table_%(i)d', metadata,\n"
+            "    Column('id', Integer, primary_key=True),\n"
+            "    Column('name', String(50), nullable=False),\n"
+            "    Column('description', String(200)),\n"
+            "    Column('amount', Numeric(10, 2)),\n"
+            "    Column('created_at', DateTime, server_default=func.now()),\n"
+            "%(fk)s"
+            "    Index('ix_table_%(i)d_name', 'name'),\n"
+            ")\n"
+            % {
+                "i": i,
+                "fk": (
+                    "    Column('parent_id', ForeignKey('table_%d.id')),\n"
+                    % (i - 1)
+                    if i
+                    else ""
+                ),
+            }
+        )
+    return "\n".join(lines)
+
+
+def build_from_source(path):
+    namespace = {"__name__": "generated_schema"}
+    with open(path) as file_:
+        exec(compile(file_.read(), path, "exec"), namespace)
+    return namespace["metadata"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure MetaData caching and create_all() checks."
+    )
+    parser.add_argument("--tables", type=int, default=1000)
+    options = parser.parse_args(argv)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source_path = os.path.join(tmpdir, "schema.py")
+        with open(source_path, "w") as file_:
+            file_.write(generate_schema_source(options.tables))
+        cache_dir = os.path.join(tmpdir, "cache")
+
+        def builder():
+            return build_from_source(source_path)
+
+        with _util.measure() as m:
+            metadata = builder()
+        rows.append(["build MetaData from source", m.elapsed])
+
+        with _util.measure() as m:
+            load_metadata(builder, [source_path], cache_dir)
+        rows.append(["build + write cache (first run)", m.elapsed])
+
+        with _util.measure() as m:
+            cached = load_metadata(builder, [source_path], cache_dir)
+        rows.append(["load MetaData from cache", m.elapsed])
+        assert len(cached.tables) == len(metadata.tables)
+
+        for label, kw in [
+            ("create_all(), checkfirst=True", {"checkfirst": True}),
+            ("create_schema(), known empty", {"known_empty": True}),
+            ("create_schema(), inspect for empty", {}),
+        ]:
+            engine = create_engine("sqlite://")
+            with engine.begin() as conn:
+                with _util.measure(engine) as m:
+                    if "checkfirst" in kw:
+                        cached.create_all(conn, **kw)
+                    else:
+                        create_schema(conn, cached, **kw)
+            engine.dispose()
+            rows.append([label, m.elapsed, m.statements])
+
+    print("%d tables" % options.tables)
+    _util.print_table(
+        ["step", "seconds", "statements"],
+        [row + [""] * (3 - len(row)) for row in rows],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""The ``User`` / ``Address`` models used in the slides, plus helpers to
+generate them at scale."""
+
+import itertools
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import ForeignKey
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import mapped_column
+from sqlalchemy.orm import MappedAsDataclass
+
+
+class Base(MappedAsDataclass, DeclarativeBase):
+    pass
+
+
+class User(Base):
+    __tablename__ = "user_account"
+
+    id: Mapped[int] = mapped_column(primary_key=True, init=False)
+    name: Mapped[str]
+    fullname: Mapped[Optional[str]]
+    created_at: Mapped[datetime] = mapped_column(
+        init=False, server_default=func.now()
+    )
+
+
+class Address(Base):
+    __tablename__ = "address"
+
+    id: Mapped[int] = mapped_column(primary_key=True, init=False)
+    email_address: Mapped[str]
+    user_id: Mapped[int] = mapped_column(ForeignKey("user_account.id"))
+
+
+def user_rows(count, start=0):
+    """Generate ``count`` parameter dictionaries for ``insert(User)``."""
+
+    for i in range(start, start + count):
+        yield {"name": "user%d" % i, "fullname": "User Number %d" % i}
+
+
+def address_rows(num_users, per_user, start_user_id=1):
+    """Generate ``per_user`` addresses for each of ``num_users`` users,
+    assuming ids are assigned sequentially from ``start_user_id``."""
+
+    for user_id in range(start_user_id, start_user_id + num_users):
+        for j in range(per_user):
+            yield {
+                "user_id": user_id,
+                "email_address": "user%d.%d@example.com" % (user_id, j),
+            }
+
+
+def chunks(iterable, size):
+    """Yield lists of up to ``size`` items from ``iterable``."""
+
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def populate(engine, num_users, addresses_per_user=0, chunk_size=10000):
+    """Create the schema and bulk-load users and addresses."""
+
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for chunk in chunks(user_rows(num_users), chunk_size):
+            conn.execute(insert(User), chunk)
+        if addresses_per_user:
+            for chunk in chunks(
+                address_rows(num_users, addresses_per_user), chunk_size
+            ):
+                conn.execute(insert(Address), chunk)
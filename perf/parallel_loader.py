@@ -0,0 +1,247 @@
+"""Load a users file into a WAL-mode SQLite database using several cores.
+
+SQLite allows only one writer at a time, so the inserts from
+``03_inserts.py`` can't simply be spread over several connections.
+Instead, the input file is split into byte ranges, one per worker
+process; workers parse, convert and encode their rows into ready-to-bind
+tuples, and send them in batches over a queue to a single writer, which
+executes and commits them against a file database in WAL mode::
+
+    python -m perf.parallel_loader --users 1000000 --workers 1 2 4 8
+
+The writer is the parent process.  It runs the INSERT with
+``exec_driver_sql()`` and pre-encoded tuples, so that it does as little
+work per row as possible; everything else happens in the workers.  An
+error in a worker is re-raised in the writer, and an error in the
+writer terminates the workers.
+
+Input is CSV as written by :func:`perf.loader.write_sample_files`, which
+must not contain newlines inside quoted fields, since the file is split
+on line boundaries.
+
+"""
+
+import argparse
+import csv
+import multiprocessing
+import os
+import queue as queue_module
+import tempfile
+import time
+import traceback
+
+from sqlalchemy import create_engine
+from sqlalchemy import event
+
+from . import _util
+from .loader import convert_user
+from .loader import write_sample_files
+from .models import Base
+
+
+insert_sql = (
+    "INSERT INTO user_account (name, fullname, created_at) VALUES (?, ?, ?)"
+)
+
+# for records without created_at, so the server default applies
+insert_default_sql = "INSERT INTO user_account (name, fullname) VALUES (?, ?)"
+
+# how the SQLite DateTime type stores values
+_datetime_format = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def split_file(path, parts):
+    """Return ``parts`` ``(start, end)`` byte ranges covering the data
+    lines of a CSV file, excluding the header."""
+
+    with open(path, "rb") as file_:
+        file_.readline()
+        data_start = file_.tell()
+    size = os.path.getsize(path)
+    step = max((size - data_start) // parts, 1)
+    bounds = [data_start + step * i for i in range(parts)] + [size]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _read_range(path, start, end):
+    """Yield the lines that begin within ``[start, end)``."""
+
+    with open(path, "rb") as file_:
+        file_.seek(start)
+        if start:
+            # back up one byte, so a range starting exactly on a line
+            # boundary keeps that line
+            file_.seek(start - 1)
+            file_.readline()
+        while file_.tell() < end:
+            line = file_.readline()
+            if not line:
+                break
+            yield line.decode("utf-8")
+
+
+def encode_user(record):
+    """Convert a user record to a tuple for :data:`insert_sql`, or, when
+    it has no ``created_at``, a shorter one for
+    :data:`insert_default_sql`."""
+
+    params = convert_user(record)
+    created_at = params.get("created_at")
+    if created_at is None:
+        return (params["name"], params["fullname"])
+    return (
+        params["name"],
+        params["fullname"],
+        created_at.strftime(_datetime_format),
+    )
+
+
+def worker(path, start, end, fields, batch_size, queue):
+    """Send batches of encoded rows, then None when done, or the
+    formatted traceback if an error occurred."""
+
+    done = None
+    try:
+        batch = []
+        for row in csv.reader(_read_range(path, start, end)):
+            batch.append(encode_user(dict(zip(fields, row))))
+            if len(batch) >= batch_size:
+                queue.put(batch)
+                batch = []
+        if batch:
+            queue.put(batch)
+    except BaseException:
+        done = traceback.format_exc()
+        raise
+    finally:
+        queue.put(done)
+
+
+def _write(conn, batch):
+    with_date = [params for params in batch if len(params) == 3]
+    if with_date:
+        conn.exec_driver_sql(insert_sql, with_date)
+    if len(with_date) < len(batch):
+        conn.exec_driver_sql(
+            insert_default_sql,
+            [params for params in batch if len(params) == 2],
+        )
+
+
+def make_engine(url):
+    engine = create_engine(url)
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+        dbapi_connection.execute("PRAGMA synchronous=NORMAL")
+
+    return engine
+
+
+def load_parallel(url, path, workers, batch_size=5000, commit_every=10):
+    """Load the users CSV at ``path`` using ``workers`` processes to
+    prepare rows, writing from this process.  Returns rows written."""
+
+    with open(path, newline="", encoding="utf-8") as file_:
+        fields = next(csv.reader(file_))
+
+    engine = make_engine(url)
+    Base.metadata.create_all(engine)
+
+    queue = multiprocessing.Queue(maxsize=workers * 4)
+    processes = [
+        multiprocessing.Process(
+            target=worker,
+            args=(path, start, end, fields, batch_size, queue),
+        )
+        for start, end in split_file(path, workers)
+    ]
+    for process in processes:
+        process.start()
+
+    total = 0
+    try:
+        with engine.connect() as conn:
+            finished = batches = 0
+            while finished < len(processes):
+                try:
+                    batch = queue.get(timeout=1)
+                except queue_module.Empty:
+                    # a worker killed outright never sends its sentinel
+                    for process in processes:
+                        if process.exitcode not in (None, 0):
+                            raise RuntimeError(
+                                "worker exited with code %d"
+                                % process.exitcode
+                            )
+                    continue
+                if batch is None:
+                    finished += 1
+                    continue
+                elif isinstance(batch, str):
+                    raise RuntimeError("worker failed:\n%s" % batch)
+                _write(conn, batch)
+                total += len(batch)
+                batches += 1
+                if not batches % commit_every:
+                    conn.commit()
+            conn.commit()
+    except BaseException:
+        # workers may be blocked on put() into the full queue
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+        engine.dispose()
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load users with parallel workers and one writer."
+    )
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=sorted({1, 2, 4, os.cpu_count() or 1}),
+    )
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--commit-every", type=int, default=10)
+    options = parser.parse_args(argv)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print("Writing sample file...")
+        path, _ = write_sample_files(tmpdir, options.users, 0, "csv")
+
+        baseline = None
+        for workers in options.workers:
+            db_path = os.path.join(tmpdir, "load_%d.db" % workers)
+            now = time.perf_counter()
+            total = load_parallel(
+                "sqlite:///%s" % db_path,
+                path,
+                workers,
+                options.batch_size,
+                options.commit_every,
+            )
+            elapsed = time.perf_counter() - now
+            if baseline is None:
+                baseline = elapsed
+            rows.append(
+                [workers, total, elapsed, total / elapsed, baseline / elapsed]
+            )
+
+    print("%d CPUs" % (os.cpu_count() or 1))
+    _util.print_table(
+        ["workers", "rows", "seconds", "rows/sec", "speedup"], rows
+    )
+
+
+if __name__ == "__main__":
+    main()
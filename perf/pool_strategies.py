@@ -0,0 +1,267 @@
+"""Compare connection pool implementations under concurrent load.
+
+Runs the ``engine.connect()`` / ``engine.begin()`` patterns from
+``01_engine_usage.py`` against the ``employee`` table from a thread pool,
+for each of ``QueuePool``, ``StaticPool``, ``SingletonThreadPool`` and
+``NullPool``, against both a memory and a file SQLite database::
+
+    python -m perf.pool_strategies --workers 1 4 16 64
+
+Reported per configuration are throughput, the time spent waiting to
+check out a connection, p50 / p99 latency of a whole operation, and the
+number of operations that failed.
+
+Note that every new connection to ``sqlite://`` is a separate, empty
+database, so the ``employee`` table is created for each new DBAPI
+connection; with ``NullPool`` that happens for every operation, which is
+the real cost of that combination.
+
+``StaticPool`` shares one DBAPI connection among all threads; as the
+sqlite3 module can't be used concurrently from several threads, an
+application using it has to serialize access, so the benchmark does the
+same with a lock, and the time spent waiting on it is counted as
+checkout wait.  ``SingletonThreadPool`` closes connections beyond its
+``pool_size`` even while other threads are using them, so its size is
+raised to the number of threads in use.
+
+"""
+
+import argparse
+import concurrent.futures
+import itertools
+import random
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import text
+from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.pool import SingletonThreadPool
+from sqlalchemy.pool import StaticPool
+
+from . import _util
+
+
+pool_classes = {
+    "QueuePool": QueuePool,
+    "StaticPool": StaticPool,
+    "SingletonThreadPool": SingletonThreadPool,
+    "NullPool": NullPool,
+}
+
+create_table = text(
+    "create table if not exists employee "
+    "(emp_id integer primary key, emp_name varchar, fullname varchar)"
+)
+insert_stmt = text(
+    "insert into employee(emp_name, fullname) values (:name, :fullname)"
+)
+select_stmt = text(
+    "select emp_id, emp_name, fullname from employee "
+    "order by emp_id desc limit 10"
+)
+
+
+def make_engine(url, poolclass, workers, pool_size, max_overflow):
+    kw = {}
+    if poolclass is QueuePool:
+        kw.update(pool_size=pool_size, max_overflow=max_overflow)
+    elif poolclass is SingletonThreadPool:
+        kw.update(pool_size=max(pool_size, workers + 1))
+
+    engine = create_engine(
+        url,
+        poolclass=poolclass,
+        connect_args={"check_same_thread": False, "timeout": 30},
+        **kw
+    )
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.execute(create_table.text)
+
+    return engine
+
+
+class Stats(object):
+    def __init__(self):
+        self.latencies = []
+        self.checkout_waits = []
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, latencies, checkout_waits, errors):
+        with self._lock:
+            self.latencies.extend(latencies)
+            self.checkout_waits.extend(checkout_waits)
+            self.errors += errors
+
+
+def worker(engine, num_ops, write_ratio, barrier, stats, seed, lock):
+    rand = random.Random(seed)
+    latencies = []
+    checkout_waits = []
+    errors = 0
+
+    barrier.wait()
+    for i in range(num_ops):
+        now = time.perf_counter()
+        try:
+            if lock is not None:
+                lock.acquire()
+            if rand.random() < write_ratio:
+                # "begin once"
+                with engine.begin() as conn:
+                    checkout_waits.append(time.perf_counter() - now)
+                    conn.execute(
+                        insert_stmt,
+                        {"name": "emp%d" % i, "fullname": "Employee %d" % i},
+                    )
+            else:
+                # "commit as you go"
+                with engine.connect() as conn:
+                    checkout_waits.append(time.perf_counter() - now)
+                    conn.execute(select_stmt).all()
+                    conn.commit()
+        except Exception:
+            errors += 1
+        finally:
+            if lock is not None:
+                lock.release()
+        latencies.append(time.perf_counter() - now)
+
+    stats.record(latencies, checkout_waits, errors)
+
+
+def run_one(url, poolclass, workers, num_ops, write_ratio, options):
+    engine = make_engine(
+        url, poolclass, workers, options.pool_size, options.max_overflow
+    )
+    lock = threading.Lock() if poolclass is StaticPool else None
+    try:
+        # warm up: create the table for file databases, compile
+        # statements
+        with engine.begin() as conn:
+            conn.execute(insert_stmt, {"name": "warmup", "fullname": ""})
+            conn.execute(select_stmt).all()
+
+        stats = Stats()
+        barrier = threading.Barrier(workers + 1)
+        per_worker = max(num_ops // workers, 1)
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = [
+                executor.submit(
+                    worker,
+                    engine,
+                    per_worker,
+                    write_ratio,
+                    barrier,
+                    stats,
+                    seed,
+                    lock,
+                )
+                for seed in range(workers)
+            ]
+            barrier.wait()
+            now = time.perf_counter()
+            for future in futures:
+                future.result()
+            elapsed = time.perf_counter() - now
+    finally:
+        engine.dispose()
+
+    total = per_worker * workers
+    return {
+        "ops_per_sec": (total - stats.errors) / elapsed,
+        "checkout_wait_ms": _util.mean(stats.checkout_waits) * 1000,
+        "p50_ms": _util.percentile(stats.latencies, 50) * 1000,
+        "p99_ms": _util.percentile(stats.latencies, 99) * 1000,
+        "errors": stats.errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare connection pools under concurrent load."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16, 32, 64],
+        help="numbers of concurrent worker threads to test",
+    )
+    parser.add_argument(
+        "--pools",
+        nargs="+",
+        choices=list(pool_classes),
+        default=list(pool_classes),
+    )
+    parser.add_argument(
+        "--databases",
+        nargs="+",
+        choices=["memory", "file"],
+        default=["memory", "file"],
+    )
+    parser.add_argument(
+        "--ops",
+        type=int,
+        default=4000,
+        help="total operations per configuration",
+    )
+    parser.add_argument(
+        "--write-ratio",
+        type=float,
+        default=0.2,
+        help="fraction of operations that INSERT and commit",
+    )
+    parser.add_argument("--pool-size", type=int, default=5)
+    parser.add_argument("--max-overflow", type=int, default=10)
+    options = parser.parse_args(argv)
+
+    rows = []
+    for database, poolname, workers in itertools.product(
+        options.databases, options.pools, options.workers
+    ):
+        with _util.database_url(database) as url:
+            result = run_one(
+                url,
+                pool_classes[poolname],
+                workers,
+                options.ops,
+                options.write_ratio,
+                options,
+            )
+        rows.append(
+            [
+                database,
+                poolname,
+                workers,
+                result["ops_per_sec"],
+                result["checkout_wait_ms"],
+                result["p50_ms"],
+                result["p99_ms"],
+                result["errors"],
+            ]
+        )
+
+    _util.print_table(
+        [
+            "database",
+            "pool",
+            "workers",
+            "ops/sec",
+            "checkout wait ms",
+            "p50 ms",
+            "p99 ms",
+            "errors",
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,511 @@
+"""An opt-in cache of SELECT results, invalidated by writes.
+
+The SELECTs in ``04_selects.py`` and ``05_orm.py`` go to the database
+on every call.  :class:`ResultCache` keeps ``Result.freeze()`` copies of
+their results, keyed by the statement's cache key plus its bound
+parameter values, with LRU and TTL eviction::
+
+    cache = ResultCache(engine, maxsize=1000, ttl=60)
+
+    # Core, or a Session, explicitly
+    result = cache.execute(conn, select(User.name).where(User.id > 1))
+
+    # or any Session.execute() / scalars() of a statement that opts in
+    cache.listen(session)
+    session.scalars(
+        select(User).where(User.name == "sandy").execution_options(
+            result_cache=True
+        )
+    )
+
+Every statement the engine executes is watched: an ``insert()``,
+``update()`` or ``delete()``, whether run directly or by a Session
+flush, drops each cached result that reads from its table, while DDL,
+such as ``metadata.drop_all()``, and textual SQL other than SELECT,
+whether ``text()`` or ``exec_driver_sql()``, clear the cache.  Other
+connections don't see a write until it's committed, and may cache what
+they read in between, so its tables are invalidated again on commit.
+Until then, reads on the writing connection bypass the cache, and a
+result isn't cached if one of its tables was invalidated after the
+transaction it was read in began.  This only covers writes through the
+engine the cache was created with, in this process; ``ttl`` bounds
+staleness from anywhere else.
+
+ORM results are merged into the requesting Session with ``load=False``,
+so cached entities aren't refreshed from the database.
+
+The benchmark runs the select slide queries and an ORM lookup in a
+read-heavy loop over a set of hot users, with an occasional committed
+update, with and without the cache::
+
+    python -m perf.result_cache --calls 2000 --hot-keys 20 --write-every 100
+
+"""
+
+import argparse
+import collections
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import select
+from sqlalchemy import Table
+from sqlalchemy import update
+from sqlalchemy.orm import loading
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.util import find_tables
+
+from . import _util
+from .models import populate
+from .models import User
+from .statement_cache import queries
+
+
+def _hashable(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    elif isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    return value
+
+
+class _Entry(object):
+    __slots__ = ("frozen", "tables", "expires")
+
+    def __init__(self, frozen, tables, expires):
+        self.frozen = frozen
+        self.tables = tables
+        self.expires = expires
+
+
+class ResultCache(object):
+    """LRU / TTL cache of frozen SELECT results for one engine.
+
+    ``maxsize`` bounds the number of results kept; ``ttl`` is seconds,
+    or None for no expiry.  The cache may be shared between threads.
+
+    """
+
+    def __init__(self, engine, maxsize=1000, ttl=None):
+        self.engine = engine
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._entries = collections.OrderedDict()
+        self._by_table = collections.defaultdict(set)
+        # every invalidation advances _generation; _invalidated and
+        # _cleared hold the generation a table, or the whole cache, was
+        # last invalidated at, and _begun the one each open transaction
+        # began at
+        self._generation = 0
+        self._invalidated = {}
+        self._cleared = 0
+        self._begun = {}
+        # connection -> tables written in its open transaction, with
+        # None for DDL or textual SQL
+        self._pending = {}
+        self.hits = self.misses = 0
+        self.evictions = self.expirations = self.invalidations = 0
+
+        for name, fn in self._events():
+            event.listen(engine, name, fn)
+
+    def _events(self):
+        return [
+            ("after_cursor_execute", self._after_cursor_execute),
+            ("begin", self._begin),
+            ("commit", self._commit),
+            ("rollback", self._rollback),
+        ]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def dispose(self):
+        """Stop watching the engine and drop everything."""
+
+        for name, fn in self._events():
+            event.remove(self.engine, name, fn)
+        self.clear()
+
+    def key(self, statement, parameters=None):
+        """The cache key for ``statement`` and ``parameters``, or None if
+        the statement can't be cached."""
+
+        if not getattr(statement, "is_select", False):
+            return None
+        cache_key = statement._generate_cache_key()
+        if cache_key is None:
+            return None
+        try:
+            key = (
+                cache_key.key,
+                _hashable(
+                    [param.effective_value for param in cache_key.bindparams]
+                ),
+                _hashable(dict(parameters or {})),
+            )
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key):
+        """Return the ``FrozenResult`` for ``key``, or None."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if (
+                entry.expires is not None
+                and entry.expires < time.monotonic()
+            ):
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.frozen
+
+    def set(self, key, statement, frozen, since=None):
+        """Cache ``frozen`` for ``key``.
+
+        ``since`` is the :meth:`generation` from before the result was
+        read; if any table ``statement`` reads from was invalidated
+        after that, the result may be stale and isn't cached.
+
+        """
+        tables = frozenset(
+            table.name
+            for table in find_tables(
+                statement,
+                check_columns=True,
+                include_aliases=True,
+                include_joins=True,
+            )
+            if isinstance(table, Table)
+        )
+        with self._lock:
+            if since is not None and (
+                self._cleared > since
+                or any(
+                    self._invalidated.get(name, 0) > since
+                    for name in tables
+                )
+            ):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(
+                frozen,
+                tables,
+                time.monotonic() + self.ttl if self.ttl is not None else None,
+            )
+            for name in tables:
+                self._by_table[name].add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for name in entry.tables:
+            keys = self._by_table.get(name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[name]
+
+    def generation(self):
+        """The current generation, which each invalidation advances."""
+
+        return self._generation
+
+    def invalidate(self, table_name):
+        """Drop every result that reads from ``table_name``."""
+
+        with self._lock:
+            self._generation += 1
+            self._invalidated[table_name] = self._generation
+            for key in list(self._by_table.get(table_name, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cleared = self._generation
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_table.clear()
+
+    def _writing(self, connection):
+        """True if ``connection`` has uncommitted writes, which results
+        from the cache wouldn't show, and which results it reads
+        mustn't be cached with."""
+
+        return connection in self._pending
+
+    def execute(self, connection, statement, parameters=None):
+        """``connection.execute(statement, parameters)``, from the cache
+        when possible.
+
+        ``connection`` is a ``Connection`` or ``Session`` of the engine
+        this cache watches.
+
+        """
+        if isinstance(connection, Session):
+            return self._session_execute(connection, statement, parameters)
+
+        key = self.key(statement, parameters)
+        if key is None or self._writing(connection):
+            return connection.execute(statement, parameters)
+        frozen = self.get(key)
+        if frozen is not None:
+            return frozen()
+        frozen = self._read(
+            key,
+            statement,
+            lambda: connection.execute(statement, parameters),
+            lambda: connection,
+        )
+        return frozen()
+
+    def _read(self, key, statement, execute, connection):
+        """Run ``execute`` and cache its frozen result, unless a table it
+        reads was invalidated after the read's transaction began."""
+
+        before = self.generation()
+        frozen = execute().freeze()
+        connection = connection()
+        with self._lock:
+            # a transaction that was already open may see data from as
+            # far back as when it began, such as with REPEATABLE READ;
+            # one the execute began started after ``before``
+            since = min(self._begun.get(connection, before), before)
+        self.set(key, statement, frozen, since)
+        return frozen
+
+    def _session_writing(self, session, bind_arguments=None):
+        if not self._pending or not session.in_transaction():
+            return False
+        return self._writing(
+            session.connection(bind_arguments=bind_arguments)
+        )
+
+    def _session_execute(self, session, statement, parameters):
+        key = self.key(statement, parameters)
+        if key is None or self._session_writing(session):
+            return session.execute(statement, parameters)
+        frozen = self.get(key)
+        if frozen is not None:
+            return loading.merge_frozen_result(
+                session, statement, frozen, load=False
+            )()
+        frozen = self._read(
+            key,
+            statement,
+            lambda: session.execute(statement, parameters),
+            session.connection,
+        )
+        return frozen()
+
+    def listen(self, target):
+        """Serve ``Session.execute()`` of statements with the
+        ``result_cache=True`` execution option from the cache.
+
+        ``target`` is a ``Session``, ``sessionmaker`` or ``Session``
+        subclass.
+
+        """
+        event.listen(target, "do_orm_execute", self._do_orm_execute)
+
+    def _do_orm_execute(self, state):
+        if not state.is_select or not state.execution_options.get(
+            "result_cache", False
+        ):
+            return None
+        key = self.key(state.statement, state.parameters)
+        if key is None or self._session_writing(
+            state.session, state.bind_arguments
+        ):
+            return None
+        frozen = self.get(key)
+        if frozen is None:
+            frozen = self._read(
+                key,
+                state.statement,
+                state.invoke_statement,
+                lambda: state.session.connection(
+                    bind_arguments=state.bind_arguments
+                ),
+            )
+        return loading.merge_frozen_result(
+            state.session, state.statement, frozen, load=False
+        )()
+
+    def _after_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        # at the cursor level, so that exec_driver_sql(), which doesn't
+        # emit after_execute, is seen along with everything else
+        if context.isinsert or context.isupdate or context.isdelete:
+            table = context.compiled.statement.table.name
+        elif context.isddl:
+            table = None
+        elif context.is_text:
+            sql = statement.lstrip().upper()
+            if sql.startswith(("SELECT", "WITH", "EXPLAIN", "PRAGMA")):
+                return
+            table = None
+        else:
+            return
+
+        # other connections can't see the write until it's committed,
+        # and may cache what they read in between; it's invalidated
+        # again on commit
+        with self._lock:
+            if conn.in_transaction():
+                self._pending.setdefault(conn, set()).add(table)
+            if table is None:
+                self.clear()
+            else:
+                self.invalidate(table)
+
+    def _begin(self, conn):
+        with self._lock:
+            self._begun[conn] = self._generation
+
+    def _commit(self, conn):
+        with self._lock:
+            self._begun.pop(conn, None)
+            tables = self._pending.pop(conn, ())
+            if None in tables:
+                self.clear()
+            else:
+                for table in tables:
+                    self.invalidate(table)
+
+    def _rollback(self, conn):
+        # the writes were invalidated when they ran, and reads within
+        # the transaction weren't cached
+        with self._lock:
+            self._begun.pop(conn, None)
+            self._pending.pop(conn, None)
+
+
+def _workload_args(hot):
+    return {
+        "users_by_name": (["user%d" % hot, "user%d" % (hot + 1), "user3"], 1),
+        "user_emails": ("user%d" % hot,),
+        "multiple_emails": (1,),
+    }
+
+
+def _run(engine, calls, write_every, hot_keys, cache):
+    """Run the workload; returns (seconds, results) where results is a
+    list of a hash of the rows each read returned."""
+
+    results = []
+    with engine.connect() as conn, Session(bind=conn) as session:
+        if cache is not None:
+            cache.listen(session)
+        now = time.perf_counter()
+        for i in range(calls):
+            hot = i % hot_keys
+            if write_every and i and not i % write_every:
+                conn.execute(
+                    update(User)
+                    .where(User.id == hot + 1)
+                    .values(fullname="Updated %d" % i)
+                )
+                conn.commit()
+                session.expire_all()
+            args = _workload_args(hot)
+            for query, forms in queries.items():
+                stmt, params = forms["plain"](*args[query])
+                if cache is not None:
+                    rows = cache.execute(conn, stmt, params).all()
+                else:
+                    rows = conn.execute(stmt, params).all()
+                results.append(hash(tuple(rows)))
+            orm_stmt = select(User).where(User.name == "user%d" % hot)
+            if cache is not None:
+                orm_stmt = orm_stmt.execution_options(result_cache=True)
+            user = session.scalars(orm_stmt).one()
+            results.append(hash((user.id, user.fullname)))
+        elapsed = time.perf_counter() - now
+    return elapsed, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the select workload with a result cache."
+    )
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument(
+        "--hot-keys",
+        type=int,
+        default=20,
+        help="number of distinct users the workload reads",
+    )
+    parser.add_argument(
+        "--write-every",
+        type=int,
+        default=100,
+        help="update a user every N iterations; 0 for never",
+    )
+    parser.add_argument("--maxsize", type=int, default=1000)
+    parser.add_argument("--ttl", type=float, default=None)
+    options = parser.parse_args(argv)
+
+    # the updates are committed, so each run gets a fresh database
+    engine = create_engine("sqlite://")
+    populate(engine, options.users, addresses_per_user=2)
+    plain, expected = _run(
+        engine, options.calls, options.write_every, options.hot_keys, None
+    )
+    engine.dispose()
+
+    engine = create_engine("sqlite://")
+    populate(engine, options.users, addresses_per_user=2)
+    cache = ResultCache(engine, maxsize=options.maxsize, ttl=options.ttl)
+    cached, results = _run(
+        engine, options.calls, options.write_every, options.hot_keys, cache
+    )
+    cache.dispose()
+    engine.dispose()
+
+    reads = options.calls * (len(queries) + 1)
+    _util.print_table(
+        ["mode", "seconds", "reads/sec", "check"],
+        [
+            ["uncached", plain, reads / plain, ""],
+            [
+                "cached",
+                cached,
+                reads / cached,
+                "" if results == expected else "MISMATCH",
+            ],
+        ],
+    )
+    print(
+        "\nhits %d, misses %d, evictions %d, expirations %d, "
+        "invalidations %d"
+        % (
+            cache.hits,
+            cache.misses,
+            cache.evictions,
+            cache.expirations,
+            cache.invalidations,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
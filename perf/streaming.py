@@ -0,0 +1,226 @@
+"""Stream large result sets with bounded memory.
+
+The Result slides in ``01_engine_usage.py`` and ``04_selects.py`` use
+``.all()``, ``.first()`` and ``.scalars()`` on a handful of rows.  Against
+a large ``user_account`` table, ``.all()`` holds every row in memory at
+once; :func:`stream` instead fetches rows in fixed-size batches using
+``yield_per`` / ``stream_results`` and ``Result.partitions()``, so memory
+use depends on the batch size and not on the size of the table.
+
+The benchmark compares time-to-first-row, total time and memory use of
+each approach::
+
+    python -m perf.streaming --rows 2000000 --ceiling-mb 64
+
+Memory is the peak traced by ``tracemalloc`` while the rows are
+consumed, which is what the strategy actually holds at once; growth of
+the resident set is shown alongside it, but the allocator seldom gives
+memory back, so it only ever goes up.  Tracing slows things down, so
+each strategy runs twice, untraced for the timings and traced for the
+memory, each time in a fresh process so that it isn't affected by the
+ones before it.  The database is a file so that it doesn't count
+towards memory.  The pysqlite driver has no server side cursors;
+``stream_results`` is accepted but the sqlite3 cursor already fetches
+lazily, so the effect is the same.
+
+"""
+
+import argparse
+import concurrent.futures
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import _util
+from .models import populate
+from .models import User
+
+
+def stream(connection, statement, batch_size=1000, scalars=False):
+    """Execute ``statement``, yielding rows a batch at a time.
+
+    ``connection`` may be a ``Connection`` or a ``Session``.  At most
+    ``batch_size`` rows are buffered at once.
+
+    """
+    result = connection.execute(
+        statement.execution_options(
+            yield_per=batch_size, stream_results=True
+        )
+    )
+    if scalars:
+        result = result.scalars()
+    for partition in result.partitions():
+        for row in partition:
+            yield row
+
+
+def _columns():
+    return select(User.id, User.name, User.fullname, User.created_at)
+
+
+def _consume_all(engine, batch_size):
+    with engine.connect() as conn:
+        rows = conn.execute(_columns()).all()
+        yield from rows
+
+
+def _consume_scalars_all(engine, batch_size):
+    with engine.connect() as conn:
+        ids = conn.scalars(select(User.id)).all()
+        yield from ids
+
+
+def _consume_iterate(engine, batch_size):
+    with engine.connect() as conn:
+        yield from conn.execute(_columns())
+
+
+def _consume_yield_per(engine, batch_size):
+    with engine.connect() as conn:
+        yield from stream(conn, _columns(), batch_size)
+
+
+def _consume_partitions(engine, batch_size):
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(
+            _columns()
+        )
+        for partition in result.partitions(batch_size):
+            yield from partition
+
+
+def _consume_orm_all(engine, batch_size):
+    with Session(engine) as session:
+        yield from session.scalars(select(User)).all()
+
+
+def _consume_orm_yield_per(engine, batch_size):
+    with Session(engine) as session:
+        yield from stream(session, select(User), batch_size, scalars=True)
+
+
+strategies = {
+    "all": _consume_all,
+    "scalars_all": _consume_scalars_all,
+    "iterate": _consume_iterate,
+    "yield_per": _consume_yield_per,
+    "partitions": _consume_partitions,
+    "orm_all": _consume_orm_all,
+    "orm_yield_per": _consume_orm_yield_per,
+}
+
+
+def run_strategy(
+    url, name, batch_size, trace_memory=False, sample_every=10000
+):
+    engine = create_engine(url)
+    baseline = _util.rss()
+    peak = baseline
+
+    count = 0
+    first_row = None
+    with _util.measure(memory=trace_memory) as measurement:
+        now = time.perf_counter()
+        for row in strategies[name](engine, batch_size):
+            if first_row is None:
+                first_row = time.perf_counter() - now
+            count += 1
+            if not count % sample_every:
+                peak = max(peak, _util.rss())
+    peak = max(peak, _util.rss())
+    engine.dispose()
+
+    return {
+        "rows": count,
+        "first_row": first_row or 0.0,
+        "elapsed": measurement.elapsed,
+        "rss_growth": (
+            peak - baseline if None not in (peak, baseline) else None
+        ),
+        "peak_traced": measurement.peak_memory,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare streaming vs. buffered result fetching."
+    )
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--strategies",
+        nargs="+",
+        choices=list(strategies),
+        default=list(strategies),
+    )
+    parser.add_argument(
+        "--ceiling-mb",
+        type=float,
+        help="report whether each strategy's peak traced memory stayed "
+        "within this many MiB",
+    )
+    options = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        url = "sqlite:///%s" % os.path.join(tmpdir, "stream.db")
+        engine = create_engine(url)
+        print("Loading %d rows..." % options.rows)
+        populate(engine, options.rows)
+        engine.dispose()
+
+        results = []
+        for name in options.strategies:
+            runs = []
+            for trace_memory in (False, True):
+                with concurrent.futures.ProcessPoolExecutor(1) as executor:
+                    runs.append(
+                        executor.submit(
+                            run_strategy,
+                            url,
+                            name,
+                            options.batch_size,
+                            trace_memory,
+                        ).result()
+                    )
+            timed, traced = runs
+            timed["peak_traced"] = traced["peak_traced"]
+            results.append((name, timed))
+
+    headers = [
+        "strategy",
+        "rows",
+        "first row ms",
+        "total s",
+        "peak traced",
+        "rss growth",
+    ]
+    if options.ceiling_mb is not None:
+        headers.append("within %g MiB" % options.ceiling_mb)
+
+    rows = []
+    for name, result in results:
+        row = [
+            name,
+            result["rows"],
+            result["first_row"] * 1000,
+            result["elapsed"],
+            _util.format_bytes(result["peak_traced"]),
+            _util.format_bytes(result["rss_growth"]),
+        ]
+        if options.ceiling_mb is not None:
+            row.append(
+                "yes"
+                if result["peak_traced"] <= options.ceiling_mb * 1024 * 1024
+                else "NO"
+            )
+        rows.append(row)
+    _util.print_table(headers, rows)
+
+
+if __name__ == "__main__":
+    main()
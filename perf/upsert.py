@@ -0,0 +1,259 @@
+"""Bulk upsert of ``User`` rows keyed by name.
+
+The slides in ``03_inserts.py`` only INSERT, so loading a user feed a
+second time duplicates its users.  :func:`upsert_users` uses the SQLite
+``insert()`` construct with ``ON CONFLICT (name) DO UPDATE``::
+
+    with engine.begin() as conn:
+        create_name_index(conn)
+        ids = upsert_users(conn, [{"name": "spongebob", "fullname": "..."}])
+
+ON CONFLICT needs a unique index on the conflict target.  The shared
+models don't declare one, so that the other benchmarks keep the slides'
+schema; :func:`create_name_index` creates it on an existing
+``user_account`` table, and fails if the table already has duplicate
+names.
+
+Rows are sent in batches as executemany; with RETURNING, SQLAlchemy's
+"insertmanyvalues" feature renders each batch as multi-VALUES
+statements, returning the id of every row inserted or updated.  Either
+a ``Connection`` or a ``Session`` may be passed.  ON CONFLICT with
+RETURNING requires SQLite 3.35 or later.
+
+The benchmark loads a feed of which a fraction of the names already
+exist, comparing the upsert with selecting existing rows and then
+running UPDATE / INSERT, and with a ``session.merge()`` loop::
+
+    python -m perf.upsert --rows 1000000 --existing 0.5
+
+"""
+
+import argparse
+
+from sqlalchemy import bindparam
+from sqlalchemy import Column
+from sqlalchemy import create_engine
+from sqlalchemy import func
+from sqlalchemy import Index
+from sqlalchemy import insert
+from sqlalchemy import MetaData
+from sqlalchemy import select
+from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import _util
+from .models import chunks
+from .models import populate
+from .models import User
+
+
+# declared against a table of its own, rather than User.__table__, so
+# that importing this module doesn't add the index to the shared schema
+name_index = Index("uq_user_account_name", "name", unique=True)
+Table("user_account", MetaData(), Column("name", String), name_index)
+
+
+def create_name_index(connection):
+    """Create the unique index on ``user_account.name`` that
+    :func:`upsert_statement` relies on, if it doesn't exist already."""
+
+    name_index.create(connection, checkfirst=True)
+
+
+def upsert_statement(update_columns=("fullname",)):
+    """Return an ``INSERT .. ON CONFLICT (name) DO UPDATE .. RETURNING
+    id`` for ``User``, updating ``update_columns`` from the new row."""
+
+    stmt = sqlite_insert(User)
+    return stmt.on_conflict_do_update(
+        index_elements=[User.name],
+        set_={name: stmt.excluded[name] for name in update_columns},
+    ).returning(User.id)
+
+
+def upsert_users(
+    connection, rows, batch_size=10000, update_columns=("fullname",)
+):
+    """Insert or update user parameter dictionaries by name.
+
+    Returns the ids of the rows inserted or updated, in no particular
+    order.  The unique index from :func:`create_name_index` must exist.
+
+    """
+    stmt = upsert_statement(update_columns)
+    ids = []
+    for chunk in chunks(rows, batch_size):
+        ids.extend(connection.execute(stmt, chunk).scalars())
+    return ids
+
+
+def _existing_ids(connection, chunk):
+    return dict(
+        connection.execute(
+            select(User.name, User.id).where(
+                User.name.in_([params["name"] for params in chunk])
+            )
+        ).all()
+    )
+
+
+def select_then_update(connection, rows, batch_size=10000):
+    """Look up each batch's names, then UPDATE those that exist and
+    INSERT the rest."""
+
+    update_stmt = (
+        update(User)
+        .where(User.id == bindparam("b_id"))
+        .values(fullname=bindparam("b_fullname"))
+    )
+    insert_stmt = insert(User).returning(User.id)
+
+    ids = []
+    for chunk in chunks(rows, batch_size):
+        existing = _existing_ids(connection, chunk)
+        updates = []
+        inserts = []
+        for params in chunk:
+            if params["name"] in existing:
+                updates.append(
+                    {
+                        "b_id": existing[params["name"]],
+                        "b_fullname": params["fullname"],
+                    }
+                )
+            else:
+                inserts.append(params)
+        if updates:
+            connection.execute(update_stmt, updates)
+            ids.extend(params["b_id"] for params in updates)
+        if inserts:
+            ids.extend(connection.execute(insert_stmt, inserts).scalars())
+    return ids
+
+
+def merge_loop(session, rows, batch_size=10000):
+    """``session.merge()`` each row, after looking up ids by name a
+    batch at a time, since ``merge()`` matches on primary key."""
+
+    ids = []
+    for chunk in chunks(rows, batch_size):
+        existing = _existing_ids(session, chunk)
+        merged = []
+        for params in chunk:
+            user = User(params["name"], params["fullname"])
+            if params["name"] in existing:
+                user.id = existing[params["name"]]
+            merged.append(session.merge(user))
+        session.flush()
+        ids.extend(user.id for user in merged)
+        session.expunge_all()
+    return ids
+
+
+def _feed(rows):
+    for i in range(rows):
+        yield {"name": "user%d" % i, "fullname": "Updated User %d" % i}
+
+
+def _run_connection(fn):
+    def run(engine, rows, batch_size):
+        with engine.begin() as conn:
+            return fn(conn, _feed(rows), batch_size)
+
+    return run
+
+
+def _run_session(fn):
+    def run(engine, rows, batch_size):
+        with Session(engine) as session:
+            ids = fn(session, _feed(rows), batch_size)
+            session.commit()
+        return ids
+
+    return run
+
+
+strategies = {
+    "upsert": _run_connection(upsert_users),
+    "upsert_session": _run_session(upsert_users),
+    "select_then_update": _run_connection(select_then_update),
+    "merge": _run_session(merge_loop),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare bulk upsert strategies for users by name."
+    )
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument(
+        "--existing",
+        type=float,
+        default=0.5,
+        help="fraction of the feed's names already in the table",
+    )
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument(
+        "--strategies",
+        nargs="+",
+        choices=list(strategies),
+        default=list(strategies),
+    )
+    options = parser.parse_args(argv)
+    existing = int(options.rows * options.existing)
+
+    rows = []
+    for name in options.strategies:
+        engine = create_engine("sqlite://")
+        populate(engine, existing)
+        with engine.begin() as conn:
+            # for every strategy, so that the name lookups are the same
+            create_name_index(conn)
+
+        with _util.measure(engine) as m:
+            ids = strategies[name](engine, options.rows, options.batch_size)
+
+        with engine.connect() as conn:
+            total, updated = conn.execute(
+                select(
+                    func.count(),
+                    func.count().filter(User.fullname.startswith("Updated")),
+                )
+            ).one()
+        engine.dispose()
+
+        rows.append(
+            [
+                name,
+                m.elapsed,
+                options.rows / m.elapsed,
+                m.statements,
+                len(ids),
+                total,
+                updated,
+            ]
+        )
+
+    print(
+        "%d rows in the feed, %d of which already exist"
+        % (options.rows, existing)
+    )
+    _util.print_table(
+        [
+            "strategy",
+            "seconds",
+            "rows/sec",
+            "statements",
+            "ids",
+            "users after",
+            "updated",
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
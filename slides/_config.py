@@ -1,6 +1,15 @@
+import collections
+import importlib.util
 import logging
+import marshal
 import os
+import queue
+import sqlite3
 import sys
+import threading
+import time
+import tracemalloc
+import weakref
 
 from sliderepl import Deck
 
@@ -12,6 +21,791 @@ banner_top = (
 )
 
 
+class _CountingCursor(object):
+    """Proxies a DBAPI cursor, counting the rows fetched from it."""
+
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def __getattr__(self, key):
+        return getattr(self._cursor, key)
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._counter.rows += 1
+            yield row
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._counter.rows += 1
+        return row
+
+    def fetchmany(self, *arg):
+        rows = self._cursor.fetchmany(*arg)
+        self._counter.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._counter.rows += len(rows)
+        return rows
+
+
+class SQLCounter(object):
+    """Counts statements, fetched rows and compiled cache use for every
+    ``Engine``.
+
+    Listens on the ``Engine`` class itself, so engines created inside of
+    slides are counted without the slides having to know about it.
+
+    Compiled cache hits and misses are counted per ``execute()`` call, and
+    also per statement shape, that is the compiled SQL string before
+    "expanding" parameters such as those of ``in_()`` are rendered.
+    Evictions are counted when an engine's cache is pruned back down to
+    its capacity.
+
+    """
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        # shape -> [hits, misses, not cached]
+        self.shapes = collections.OrderedDict()
+        self._engines = weakref.WeakSet()
+        self._installed = False
+
+    def install(self):
+        if not self._installed:
+            from sqlalchemy import event
+            from sqlalchemy.engine import Engine
+
+            event.listen(Engine, "before_cursor_execute", self._before)
+            event.listen(Engine, "after_cursor_execute", self._after)
+            event.listen(Engine, "after_execute", self._after_execute)
+            self._installed = True
+
+    def uninstall(self):
+        if self._installed:
+            from sqlalchemy import event
+            from sqlalchemy.engine import Engine
+
+            event.remove(Engine, "before_cursor_execute", self._before)
+            event.remove(Engine, "after_cursor_execute", self._after)
+            event.remove(Engine, "after_execute", self._after_execute)
+            self._installed = False
+
+    def _before(self, conn, cursor, statement, parameters, context, many):
+        self.statements += 1
+
+    def _after(self, conn, cursor, statement, parameters, context, many):
+        if context is not None and cursor.description is not None:
+            context.cursor = _CountingCursor(cursor, self)
+
+    def _after_execute(
+        self, conn, clauseelement, multiparams, params, options, result
+    ):
+        engine = conn.engine
+        if engine not in self._engines:
+            self._engines.add(engine)
+            self._watch_evictions(engine._compiled_cache)
+
+        context = getattr(result, "context", None)
+        if context is None:
+            return
+
+        compiled = getattr(context, "compiled", None)
+        shape = getattr(compiled, "string", None) or context.statement
+        counts = self.shapes.get(shape)
+        if counts is None:
+            counts = self.shapes[shape] = [0, 0, 0]
+
+        status = getattr(context.cache_hit, "name", None)
+        if status == "CACHE_HIT":
+            self.cache_hits += 1
+            counts[0] += 1
+        elif status == "CACHE_MISS":
+            self.cache_misses += 1
+            counts[1] += 1
+        else:
+            counts[2] += 1
+
+    def _watch_evictions(self, cache):
+        if cache is None:
+            return
+        size_alert = cache.size_alert
+
+        def alert(cache):
+            self.cache_evictions += max(len(cache) - cache.capacity, 0)
+            if size_alert is not None:
+                size_alert(cache)
+
+        cache.size_alert = alert
+
+    def cache_size(self):
+        """Return ``(entries, capacity)`` summed over all engines seen."""
+
+        entries = capacity = 0
+        for engine in list(self._engines):
+            cache = engine._compiled_cache
+            if cache is not None:
+                entries += len(cache)
+                capacity += cache.capacity
+        return entries, capacity
+
+    def format_cache(self, limit=20):
+        entries, capacity = self.cache_size()
+        lines = [
+            "%% compiled cache: %d hits, %d misses, %d evictions, "
+            "%d / %d entries"
+            % (
+                self.cache_hits,
+                self.cache_misses,
+                self.cache_evictions,
+                entries,
+                capacity,
+            ),
+            "%7s %7s %7s  %s" % ("hits", "misses", "uncached", "statement"),
+        ]
+        shapes = sorted(
+            self.shapes.items(), key=lambda item: item[1][1], reverse=True
+        )
+        for shape, (hits, misses, uncached) in shapes[:limit]:
+            lines.append(
+                "%7d %7d %7d  %s"
+                % (hits, misses, uncached, " ".join(shape.split())[:60])
+            )
+        if len(shapes) > limit:
+            lines.append("... %d more" % (len(shapes) - limit))
+        return "\n".join(lines)
+
+
+class SlideTiming(object):
+    __slots__ = (
+        "number", "title", "elapsed", "statements", "rows", "peak_memory",
+        "traced", "cache_hits", "cache_misses", "cache_evictions", "error",
+    )
+
+    def __init__(self, number, title):
+        self.number = number
+        self.title = title
+        self.elapsed = 0.0
+        self.statements = 0
+        self.rows = 0
+        self.peak_memory = None
+        self.traced = False
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        self.error = None
+
+
+def _peak_rss():
+    """Peak resident set size of this process in bytes, or None."""
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class SlideTimeline(object):
+    """Records wall-clock time, SQL statements, rows fetched and memory
+    for each slide run.
+
+    Memory is by default how far the process's peak resident set size
+    grew while the slide ran, which costs nothing to measure but only
+    shows slides that push the peak higher.  With ``trace_memory=True``
+    the slide's peak Python allocations are traced with
+    ``tracemalloc`` instead, which is accurate per slide but makes the
+    slide itself run several times slower, so its time is marked as
+    traced.
+
+    Running a slide again replaces its earlier timing.
+
+    """
+
+    sort_keys = {
+        "order": (lambda t: t.number, False),
+        "time": (lambda t: t.elapsed, True),
+        "statements": (lambda t: t.statements, True),
+        "rows": (lambda t: t.rows, True),
+        "memory": (lambda t: t.peak_memory or 0, True),
+        "misses": (lambda t: t.cache_misses, True),
+    }
+
+    def __init__(self, trace_memory=False):
+        self.timings = []
+        self.trace_memory = trace_memory
+        self.counter = SQLCounter()
+
+    def _record(self, timing):
+        for index, existing in enumerate(self.timings):
+            if existing.number == timing.number:
+                self.timings[index] = timing
+                return
+        self.timings.append(timing)
+
+    def run(self, number, title, fn, *arg, **kw):
+        """Run ``fn``, recording a :class:`.SlideTiming` for it."""
+
+        timing = SlideTiming(number, title)
+        self._record(timing)
+
+        counter = self.counter
+        counter.install()
+        start = (
+            counter.statements,
+            counter.rows,
+            counter.cache_hits,
+            counter.cache_misses,
+            counter.cache_evictions,
+        )
+
+        tracing = was_tracing = False
+        if self.trace_memory:
+            tracing = True
+            was_tracing = tracemalloc.is_tracing()
+            if not was_tracing:
+                tracemalloc.start()
+            elif hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            mem_start = tracemalloc.get_traced_memory()[0]
+        else:
+            mem_start = _peak_rss()
+
+        now = time.perf_counter()
+        try:
+            return fn(*arg, **kw)
+        except BaseException as err:
+            timing.error = err
+            raise
+        finally:
+            timing.elapsed = time.perf_counter() - now
+            timing.traced = tracing
+            if tracing:
+                timing.peak_memory = max(
+                    tracemalloc.get_traced_memory()[1] - mem_start, 0
+                )
+                if not was_tracing:
+                    tracemalloc.stop()
+            elif mem_start is not None:
+                timing.peak_memory = _peak_rss() - mem_start
+            (
+                timing.statements,
+                timing.rows,
+                timing.cache_hits,
+                timing.cache_misses,
+                timing.cache_evictions,
+            ) = (
+                counter.statements - start[0],
+                counter.rows - start[1],
+                counter.cache_hits - start[2],
+                counter.cache_misses - start[3],
+                counter.cache_evictions - start[4],
+            )
+
+    def sorted(self, sort="order"):
+        if sort not in self.sort_keys:
+            raise ValueError(
+                "sort must be one of: %s" % ", ".join(self.sort_keys)
+            )
+        key, reverse = self.sort_keys[sort]
+        return sorted(self.timings, key=key, reverse=reverse)
+
+    def format(self, sort="order"):
+        lines = [
+            "%5s  %-36s %10s %6s %8s %10s %13s"
+            % (
+                "slide",
+                "title",
+                "time (ms)",
+                "stmts",
+                "rows",
+                "memory",
+                "cache h/m/e",
+            )
+        ]
+        for t in self.sorted(sort):
+            title = (t.title or "")[:36]
+            if t.error is not None:
+                title = ("!! " + title)[:36]
+            lines.append(
+                "%5d  %-36s %9.2f%1s %6d %8d %10s %13s"
+                % (
+                    t.number,
+                    title,
+                    t.elapsed * 1000,
+                    "*" if t.traced else "",
+                    t.statements,
+                    t.rows,
+                    _format_bytes(t.peak_memory)
+                    if t.peak_memory is not None
+                    else "",
+                    "%d/%d/%d"
+                    % (t.cache_hits, t.cache_misses, t.cache_evictions),
+                )
+            )
+        lines.append(
+            "%5s  %-36s %10.2f %6d %8d %10s %13s"
+            % (
+                "",
+                "total",
+                sum(t.elapsed for t in self.timings) * 1000,
+                sum(t.statements for t in self.timings),
+                sum(t.rows for t in self.timings),
+                "",
+                "%d/%d/%d"
+                % (
+                    sum(t.cache_hits for t in self.timings),
+                    sum(t.cache_misses for t in self.timings),
+                    sum(t.cache_evictions for t in self.timings),
+                ),
+            )
+        )
+        if any(t.traced for t in self.timings):
+            lines.append(
+                "* run with tracemalloc: memory is the slide's peak traced "
+                "allocations, time is inflated"
+            )
+        else:
+            lines.append(
+                "memory is the growth of the process's peak RSS; "
+                "\"timeline trace\" traces allocations instead"
+            )
+        return "\n".join(lines)
+
+
+def _format_bytes(num):
+    for unit in ("B", "KiB", "MiB"):
+        if num < 1024:
+            return "%d %s" % (num, unit)
+        num /= 1024.0
+    return "%.1f GiB" % num
+
+
+class BufferedEchoHandler(logging.Handler):
+    """Logging handler that highlights SQL echo on a background thread.
+
+    Records are handed to a worker thread through a bounded queue so that
+    the thread running the slide only pays for a ``put()``.  Highlighted
+    statements are kept in an LRU cache of ``cache_size`` entries, so a
+    statement that's echoed over and over is only run through Pygments
+    once; parameter records, which rarely repeat, are written without
+    highlighting and aren't cached.
+
+    ``mode`` is one of:
+
+    * ``"buffered"`` - every record is written.
+    * ``"sample"`` - the first occurrence of a statement is written, then
+      only every ``sample_every``'th repeat of it.  Counts are kept for
+      the ``cache_size`` most recently seen statements.
+    * ``"digest"`` - consecutive repeats of the same statement are
+      collapsed into a single "repeated N times" line.
+
+    In "sample" and "digest" modes, the parameter records that follow a
+    skipped statement are skipped along with it.
+
+    """
+
+    modes = ("buffered", "sample", "digest")
+
+    def __init__(
+        self,
+        stream,
+        mode="buffered",
+        sample_every=100,
+        cache_size=1000,
+        queue_size=10000,
+    ):
+        if mode not in self.modes:
+            raise ValueError(
+                "mode must be one of: %s" % ", ".join(self.modes)
+            )
+        logging.Handler.__init__(self)
+        self.stream = stream
+        self.mode = mode
+        self.sample_every = max(int(sample_every), 1)
+        self.cache_size = cache_size
+
+        self._cache = collections.OrderedDict()
+        self._seen = collections.OrderedDict()
+        self._last_statement = None
+        self._repeats = 0
+        self._skipping = False
+
+        self._queue = queue.Queue(queue_size)
+        self._thread = threading.Thread(
+            target=self._worker, name="sql-echo", daemon=True
+        )
+        self._thread.start()
+
+    @staticmethod
+    def _is_parameters(record):
+        # SQLAlchemy logs the parameters for a statement as a separate
+        # record, formatted as "[<stats>] <params>"
+        return isinstance(record.msg, str) and record.msg.startswith("[")
+
+    def emit(self, record):
+        if self.mode == "buffered":
+            self._queue.put(record)
+            return
+
+        if self._is_parameters(record):
+            if not self._skipping:
+                self._queue.put(record)
+            return
+
+        statement = record.getMessage()
+
+        if self.mode == "digest":
+            if statement == self._last_statement:
+                self._repeats += 1
+                self._skipping = True
+                return
+            self._put_digest()
+            self._last_statement = statement
+        else:
+            count = self._seen.pop(statement, 0) + 1
+            self._seen[statement] = count
+            if len(self._seen) > self.cache_size:
+                self._seen.popitem(last=False)
+            if count > 1 and count % self.sample_every:
+                self._skipping = True
+                return
+            if count > 1:
+                self._queue.put(
+                    "-- sampled: occurrence #%d of this statement" % count
+                )
+
+        self._skipping = False
+        self._queue.put(record)
+
+    def _put_digest(self):
+        if self._repeats:
+            self._queue.put(
+                "-- previous statement repeated %d more times"
+                % self._repeats
+            )
+            self._repeats = 0
+
+    def _highlight(self, text):
+        try:
+            highlighted = self._cache[text]
+        except KeyError:
+            pass
+        else:
+            self._cache.move_to_end(text)
+            return highlighted
+
+        from pygments import highlight
+        from pygments.formatters import TerminalFormatter
+        from pygments.lexers import SqlLexer
+
+        highlighted = highlight(text, SqlLexer(), TerminalFormatter())
+        self._cache[text] = highlighted
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return highlighted
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if not isinstance(item, logging.LogRecord):
+                    text = "[SQL]: %s\n" % item
+                elif self._is_parameters(item):
+                    text = self.format(item) + "\n"
+                else:
+                    text = self._highlight(self.format(item))
+                self.stream.write(text)
+                self.stream.flush()
+            except Exception:
+                if isinstance(item, logging.LogRecord):
+                    self.handleError(item)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Wait for all queued records to be written."""
+        if self.mode == "digest":
+            self._put_digest()
+            self._last_statement = None
+        if self._thread.is_alive():
+            self._queue.join()
+
+    def close(self):
+        self.flush()
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        logging.Handler.close(self)
+
+
+class DatabaseSnapshots(object):
+    """Checkpoints the in-memory SQLite databases in a namespace.
+
+    After each slide, every ``Engine`` in the namespace that refers to a
+    SQLite memory database has its database copied, using
+    ``Connection.serialize()`` where available (Python 3.11) and
+    ``Connection.backup()`` otherwise.  Restoring a checkpoint copies it
+    back into the same connection, which takes milliseconds compared to
+    replaying the slides that built it.
+
+    A database that hasn't changed since its last checkpoint shares that
+    checkpoint rather than being copied again.  Databases with a
+    transaction in progress are neither checkpointed nor restored.
+
+    """
+
+    def __init__(self):
+        # slide number -> {id(engine): (engine ref, data)}
+        self._snapshots = {}
+        # id(engine) -> (fingerprint, data)
+        self._last = {}
+
+    @staticmethod
+    def _memory_engines(namespace):
+        if "sqlalchemy" not in sys.modules:
+            # nothing could have made an Engine yet
+            return
+
+        from sqlalchemy.engine import Engine
+
+        seen = set()
+        for value in list(namespace.values()):
+            if (
+                isinstance(value, Engine)
+                and id(value) not in seen
+                and value.dialect.name == "sqlite"
+                and value.url.database in (None, "", ":memory:")
+            ):
+                seen.add(id(value))
+                yield value
+
+    @staticmethod
+    def _driver_connection(engine):
+        raw = engine.raw_connection()
+        try:
+            return raw.driver_connection
+        finally:
+            # SingletonThreadPool keeps the connection for this thread
+            raw.close()
+
+    @staticmethod
+    def _fingerprint(dbapi_conn):
+        (schema_version,) = dbapi_conn.execute(
+            "PRAGMA schema_version"
+        ).fetchone()
+        return dbapi_conn.total_changes, schema_version
+
+    @staticmethod
+    def _copy(dbapi_conn):
+        if hasattr(dbapi_conn, "serialize"):
+            return dbapi_conn.serialize()
+        copy = sqlite3.connect(":memory:", check_same_thread=False)
+        dbapi_conn.backup(copy)
+        return copy
+
+    @staticmethod
+    def _load(dbapi_conn, data):
+        if isinstance(data, bytes):
+            dbapi_conn.deserialize(data)
+        else:
+            data.backup(dbapi_conn)
+
+    def take(self, number, namespace):
+        """Checkpoint databases as they are after slide ``number``."""
+
+        snapshot = {}
+        for engine in self._memory_engines(namespace):
+            dbapi_conn = self._driver_connection(engine)
+            if dbapi_conn.in_transaction:
+                continue
+            fingerprint = self._fingerprint(dbapi_conn)
+            last = self._last.get(id(engine))
+            if last is not None and last[0] == fingerprint:
+                data = last[1]
+            else:
+                data = self._copy(dbapi_conn)
+                self._last[id(engine)] = (fingerprint, data)
+            snapshot[id(engine)] = (weakref.ref(engine), data)
+        self._snapshots[number] = snapshot
+
+    def has(self, number):
+        return number in self._snapshots
+
+    def restore(self, number, namespace):
+        """Restore databases to how they were after slide ``number``.
+
+        Returns False if there's no checkpoint for that slide.
+
+        """
+        if number not in self._snapshots:
+            return False
+
+        snapshot = self._snapshots[number]
+        for engine in self._memory_engines(namespace):
+            if id(engine) not in snapshot:
+                continue
+            ref, data = snapshot[id(engine)]
+            if ref() is not engine:
+                continue
+            dbapi_conn = self._driver_connection(engine)
+            if dbapi_conn.in_transaction:
+                continue
+            self._load(dbapi_conn, data)
+            self._last[id(engine)] = (self._fingerprint(dbapi_conn), data)
+        return True
+
+    def clear(self):
+        self._snapshots.clear()
+        self._last.clear()
+
+
+def parse_slides(path):
+    """Return a list of ``(number, title, flags, code)`` for the slides in
+    a deck.
+
+    Lines that aren't code are blanked out rather than removed so that
+    line numbers in tracebacks match the deck file.
+
+    """
+    slides = []
+    lines = None
+    title = flags = None
+
+    with open(path, encoding="utf-8") as file_:
+        for lineno, line in enumerate(file_, 1):
+            if line.startswith("### slide::"):
+                if lines is not None:
+                    slides.append(
+                        (len(slides) + 1, title, flags, "".join(lines))
+                    )
+                lines = ["\n"] * lineno
+                title = None
+                flags = line[len("### slide::"):].strip()
+            elif lines is None:
+                continue
+            elif line.startswith("###"):
+                if line.startswith("### title::"):
+                    title = line[len("### title::"):].strip()
+                lines.append("\n")
+            else:
+                lines.append(line)
+
+    if lines is not None:
+        slides.append((len(slides) + 1, title, flags, "".join(lines)))
+    return slides
+
+
+class SlideCodeCache(object):
+    """On-disk cache of the code objects compiled for a deck.
+
+    Stored in ``__pycache__`` next to the deck, in the same way as
+    Python's own .pyc files; the cache is keyed by the deck's path,
+    mtime and size, and the Python version, and is discarded when any
+    of those change.
+
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        directory, filename = os.path.split(self.path)
+        self.cache_path = os.path.join(
+            directory,
+            "__pycache__",
+            "%s.slides.%s.cache"
+            % (
+                os.path.splitext(filename)[0],
+                sys.implementation.cache_tag,
+            ),
+        )
+        self._code = {}
+        self._dirty = False
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self._key = None
+        else:
+            self._key = (
+                self.path,
+                stat.st_mtime_ns,
+                stat.st_size,
+                importlib.util.MAGIC_NUMBER,
+            )
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_path, "rb") as file_:
+                key, code = marshal.load(file_)
+        except (OSError, EOFError, ValueError, TypeError):
+            return
+        if key == self._key:
+            self._code = code
+
+    def compile(
+        self, source, filename, mode, flags=0, dont_inherit=False,
+        optimize=-1,
+    ):
+        """Drop-in replacement for the builtin ``compile()``."""
+
+        if not isinstance(source, str) or self._key is None:
+            return compile(
+                source, filename, mode, flags, dont_inherit, optimize
+            )
+        key = (source, filename, mode, flags, dont_inherit, optimize)
+        try:
+            return self._code[key]
+        except KeyError:
+            code = self._code[key] = compile(
+                source, filename, mode, flags, dont_inherit, optimize
+            )
+            self._dirty = True
+            return code
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmp = "%s.%d.tmp" % (self.cache_path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(tmp, "wb") as file_:
+                marshal.dump((self._key, self._code), file_)
+            os.replace(tmp, self.cache_path)
+        except OSError:
+            # a read-only checkout just doesn't get a cache
+            pass
+        else:
+            self._dirty = False
+
+
+class _LazyStream(object):
+    """Stream that's created the first time it's written to."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._stream = None
+
+    def write(self, text):
+        if self._stream is None:
+            self._stream = self._factory()
+        return self._stream.write(text)
+
+    def flush(self):
+        if self._stream is not None:
+            self._stream.flush()
+
 
 class SADeck(Deck):
     style_lookup = {
@@ -38,24 +832,52 @@ class SADeck(Deck):
     min_banner_width = 106
     bullet_width = 100
 
-    expose = Deck.expose + ("echo",)
+    expose = Deck.expose + ("echo", "timeline", "cache")
 
     def __init__(self, path=None, echo_on=True, **options):
         Deck.__init__(self, path, **options)
         self.start_with_echo = echo_on
         self.banner_top = self._color(banner_top, "plain")
+        self._timeline = SlideTimeline()
+        self._timeline_shown = False
+        self._echo = "off"
+        self._echo_handler = None
+        self._environ = {}
+        self._snapshots = DatabaseSnapshots()
+        self._code_cache = path and SlideCodeCache(path) or None
+
+    class Slide(Deck.Slide):
+        def _close(self):
+            # Deck.Slide._close(), compiling each block through the
+            # deck's SlideCodeCache rather than the builtin compile()
+            cache = getattr(self.deck, "_code_cache", None)
+            if cache is None:
+                return Deck.Slide._close(self)
+            if self._stack:
+                code = cache.compile("".join(self._stack), self.file, "single")
+                self.codeblocks.append((self._stack, code))
+                self._stack = []
+
+    @classmethod
+    def from_path(cls, path, **options):
+        deck = super(SADeck, cls).from_path(path, **options)
+        if deck._code_cache is not None:
+            deck._code_cache.save()
+        return deck
 
     def setup_environ(self, environ):
-        import termcolor
+        self._environ = environ
 
         def _print(text):
+            import termcolor
+
             print(termcolor.colored(text, attrs=["bold"]))
         environ["print"] = _print
 
     def start(self):
         logging_config = {
             "format": "[SQL]: %(message)s",
-            "stream": self.highlight_stdout("sql"),
+            "stream": _LazyStream(lambda: self.highlight_stdout("sql")),
         }
         logging.basicConfig(**logging_config)
 
@@ -63,18 +885,129 @@ class SADeck(Deck):
 
         self._set_echo(self.start_with_echo and "on" or "off")
 
-    def echo(self):
-        """Toggle SQL echo on or off."""
-        self._set_echo(not self._echo)
+        for number, slide in enumerate(self.slides, 1):
+            slide.run = self._timed(number, slide, slide.run)
+
+    def _timed(self, number, slide, run):
+        def go(*arg, **kw):
+            try:
+                result = self._timeline.run(
+                    number, getattr(slide, "title", None), run, *arg, **kw
+                )
+            finally:
+                if self._echo_handler is not None:
+                    self._echo_handler.flush()
+            self._snapshots.take(number, self._environ)
+            return result
+
+        return go
+
+    def next(self):
+        Deck.next(self)
+        if (
+            not self._timeline_shown
+            and self._timeline.timings
+            and self.current >= len(self.slides)
+        ):
+            self._timeline_shown = True
+            self.timeline()
+
+    def goto(self, slide_number):
+        """Jump to a slide by number.
+
+        If the database state from before that slide was checkpointed,
+        it's restored rather than replaying the slides in between.
+        """
+        number = int(slide_number)
+        if (
+            1 < number <= len(self.slides)
+            and self._snapshots.has(number - 1)
+        ):
+            self._snapshots.restore(number - 1, self._environ)
+            self.current = number - 1
+            self.next()
+        else:
+            Deck.goto(self, slide_number)
+
+    def rerun(self):
+        """Re-run the current slide, restoring the database state from
+        before it was first run."""
+        self._snapshots.restore(self.current - 1, self._environ)
+        Deck.rerun(self)
+
+    def timeline(self, sort="order"):
+        """Show per-slide time, statements, rows and memory.
+
+        Sort by one of: order, time, statements, rows, memory, misses.
+        "timeline trace" toggles measuring memory with tracemalloc for
+        the slides run after it, which is more precise but slows them.
+        """
+        if sort == "trace":
+            timeline = self._timeline
+            timeline.trace_memory = not timeline.trace_memory
+            print(
+                "%% tracemalloc is now %s"
+                % ("ON" if timeline.trace_memory else "OFF")
+            )
+            return
+        try:
+            text = self._timeline.format(sort)
+        except ValueError as err:
+            print("%% %s" % err)
+        else:
+            print(text)
+
+    def cache(self, limit=20):
+        """Show compiled cache hits, misses, evictions and size, per
+        statement shape."""
+        print(self._timeline.counter.format_cache(int(limit)))
+
+    def echo(self, mode=None, sample_every=100):
+        """Toggle SQL echo on or off, or set an echo mode.
+
+        Modes are: on, off, buffered, sample, digest.  "buffered" does
+        highlighting on a background thread; "sample" additionally shows
+        only every Nth repeat of a statement (default 100); "digest"
+        collapses consecutive repeats into a count.
+        """
+        if mode is None:
+            mode = "off" if self._echo != "off" else "on"
+        self._set_echo(mode, sample_every=sample_every)
+
+    def _set_echo(self, value, sample_every=100):
+        if value is True:
+            value = "on"
+        elif value is False or value is None:
+            value = "off"
+
+        if value not in ("on", "off") + BufferedEchoHandler.modes:
+            print("%% Unknown echo mode %r" % (value,))
+            return
 
-    def _set_echo(self, value):
-        self._echo = value
         log = logging.getLogger("sqlalchemy.engine")
-        if self._echo:
+
+        if self._echo_handler is not None:
+            log.removeHandler(self._echo_handler)
+            self._echo_handler.close()
+            self._echo_handler = None
+            log.propagate = True
+
+        if value in BufferedEchoHandler.modes:
+            self._echo_handler = BufferedEchoHandler(
+                sys.stdout, mode=value, sample_every=sample_every
+            )
+            self._echo_handler.setFormatter(
+                logging.Formatter("[SQL]: %(message)s")
+            )
+            log.addHandler(self._echo_handler)
+            log.propagate = False
+
+        self._echo = value
+        if value != "off":
             log.setLevel(logging.INFO)
         else:
             log.setLevel(logging.WARN)
-        print("%% SQL echo is now %s" % (self._echo and "ON" or "OFF"))
+        print("%% SQL echo is now %s" % value.upper())
 
 
 deck = SADeck
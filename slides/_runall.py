@@ -0,0 +1,167 @@
+"""Run every deck from start to finish with no prompts.
+
+Each deck runs in its own process; the pass/fail status, time, statement
+and row counts for every slide are collected into a single JSON report::
+
+    python slides/_runall.py -o report.json
+
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import glob
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import traceback
+
+import _config
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_deck(path):
+    """Run all slides in a deck; return its report as a dictionary."""
+
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.WARN)
+    sys.path.insert(0, os.path.dirname(path))
+
+    timeline = _config.SlideTimeline()
+    code_cache = _config.SlideCodeCache(path)
+    namespace = {"__name__": "__main__", "__file__": path}
+    slides = []
+
+    def run_slide(code):
+        exec(code_cache.compile(code, path, "exec"), namespace)
+
+    now = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        for number, title, flags, code in _config.parse_slides(path):
+            if "x" in flags:
+                # display-only slides, not meant to be run in sequence
+                slides.append(
+                    {"number": number, "title": title, "status": "skip"}
+                )
+                continue
+
+            error = None
+            try:
+                with contextlib.redirect_stdout(devnull):
+                    timeline.run(number, title, run_slide, code)
+            except Exception:
+                error = traceback.format_exc()
+
+            timing = timeline.timings[-1]
+            slides.append(
+                {
+                    "number": number,
+                    "title": title,
+                    "status": "fail" if error else "pass",
+                    "elapsed_ms": timing.elapsed * 1000,
+                    "statements": timing.statements,
+                    "rows": timing.rows,
+                    "peak_memory": timing.peak_memory,
+                    "cache_hits": timing.cache_hits,
+                    "cache_misses": timing.cache_misses,
+                    "cache_evictions": timing.cache_evictions,
+                    "error": error,
+                }
+            )
+
+    timeline.counter.uninstall()
+    code_cache.save()
+
+    return {
+        "deck": os.path.basename(path),
+        "status": (
+            "fail" if any(s["status"] == "fail" for s in slides) else "pass"
+        ),
+        "elapsed_ms": (time.perf_counter() - now) * 1000,
+        "statements": sum(s.get("statements", 0) for s in slides),
+        "rows": sum(s.get("rows", 0) for s in slides),
+        "slides": slides,
+    }
+
+
+def run_decks(paths, workers=None):
+    """Run decks in a process pool, one process per deck."""
+
+    import sqlalchemy
+
+    now = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers or len(paths) or 1
+    ) as executor:
+        decks = list(executor.map(run_deck, paths))
+
+    return {
+        "status": (
+            "fail" if any(d["status"] == "fail" for d in decks) else "pass"
+        ),
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "elapsed_ms": (time.perf_counter() - now) * 1000,
+        "decks": decks,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "decks",
+        nargs="*",
+        help="deck files to run; defaults to all slides/0*_*.py",
+    )
+    parser.add_argument(
+        "-o", "--output", help="write the JSON report to this file"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="number of processes; defaults to one per deck",
+    )
+    options = parser.parse_args(argv)
+
+    paths = [
+        os.path.abspath(path)
+        for path in (
+            options.decks or sorted(glob.glob(os.path.join(here, "0*_*.py")))
+        )
+    ]
+    report = run_decks(paths, workers=options.workers)
+
+    if options.output:
+        with open(options.output, "w") as file_:
+            json.dump(report, file_, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+    for deck in report["decks"]:
+        failed = [s for s in deck["slides"] if s["status"] == "fail"]
+        sys.stderr.write(
+            "%-28s %s  %4d slides %9.1f ms %6d stmts%s\n"
+            % (
+                deck["deck"],
+                deck["status"].upper(),
+                len(deck["slides"]),
+                deck["elapsed_ms"],
+                deck["statements"],
+                (
+                    "  (first failure: slide %d)" % failed[0]["number"]
+                    if failed
+                    else ""
+                ),
+            )
+        )
+
+    return 0 if report["status"] == "pass" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())